@@ -0,0 +1,151 @@
+import asyncio
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from time import monotonic
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message
+
+import config
+from metrics import admission_queue_time
+
+RATE_LIMITED_MESSAGE = "You are sending messages too fast, please wait a few seconds."
+BUSY_MESSAGE = "The bot is busy right now, please retry in a few seconds."
+
+
+class Busy(Exception):
+    pass
+
+
+class RateLimiter(object):
+    """
+    Token bucket per user: `rate` messages per second with bursts of up to `burst` messages.
+    Buckets of the least recently seen users are dropped past `max_users`.
+    """
+
+    def __init__(self, rate=config.USER_RATE, burst=config.USER_BURST, max_users=10000):
+        self.rate = rate
+        self.burst = burst
+        self.max_users = max_users
+        self.buckets = OrderedDict()  # user_id -> [tokens, last_update, warned]
+        self.limited = 0
+
+    def allow(self, user_id):
+        now = monotonic()
+        bucket = self.buckets.pop(user_id, None) or [self.burst, now, False]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        self.buckets[user_id] = bucket
+        if len(self.buckets) > self.max_users:
+            self.buckets.popitem(last=False)
+
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            bucket[2] = False
+            return True
+        self.limited += 1
+        return False
+
+    def should_warn(self, user_id):
+        # Only the first rejected message of a burst gets a reply, the rest are dropped silently.
+        bucket = self.buckets.get(user_id)
+        if bucket is None or bucket[2]:
+            return False
+        bucket[2] = True
+        return True
+
+
+class AdmissionController(object):
+    """
+    Global cap on the messages that run the models: `max_active` at once, up to `max_waiting` more queued for
+    at most `timeout` seconds. Over capacity, slot() raises Busy instead of queueing unbounded work.
+    """
+
+    def __init__(self, max_active=config.MAX_GENERATIONS, max_waiting=config.GENERATION_QUEUE_SIZE,
+                 timeout=config.GENERATION_QUEUE_TIMEOUT):
+        self.max_active = max_active
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.semaphore = asyncio.Semaphore(max_active)
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+
+    async def acquire(self):
+        if self.semaphore.locked() and self.waiting >= self.max_waiting:
+            self.rejected += 1
+            raise Busy()
+        start = monotonic()
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self.semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.rejected += 1
+            raise Busy()
+        finally:
+            self.waiting -= 1
+        admission_queue_time.observe(monotonic() - start)
+        self.active += 1
+        self.admitted += 1
+
+    def release(self):
+        self.active -= 1
+        self.semaphore.release()
+
+    @asynccontextmanager
+    async def slot(self):
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    def stats(self):
+        return {'active': self.active, 'waiting': self.waiting, 'admitted': self.admitted, 'rejected': self.rejected}
+
+
+def needs_generation(message: Message, raw_state):
+    # /run creates the attack, plain text inside a scene is answered by the models. Other commands are cheap.
+    text = message.text or ''
+    if text.startswith('/'):
+        return text.split()[0].split('@')[0] == '/run'
+    return raw_state is not None
+
+
+class AdmissionMiddleware(BaseMiddleware):
+    """
+    Outer message middleware of the dispatcher: per-user rate limit on every message, then a generation slot
+    for the messages that need the models.
+    """
+
+    def __init__(self, rate_limiter=None, controller=None):
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter()
+        self.controller = controller if controller is not None else AdmissionController()
+
+    async def __call__(self, handler, event: Message, data):
+        if event.from_user is None:
+            return await handler(event, data)
+
+        if not self.rate_limiter.allow(event.from_user.id):
+            if self.rate_limiter.should_warn(event.from_user.id):
+                await event.answer(RATE_LIMITED_MESSAGE)
+            return None
+
+        if not needs_generation(event, data.get('raw_state')):
+            return await handler(event, data)
+
+        try:
+            await self.controller.acquire()
+        except Busy:
+            return await event.answer(BUSY_MESSAGE)
+        try:
+            return await handler(event, data)
+        finally:
+            self.controller.release()
+
+    def stats(self):
+        return dict(self.controller.stats(), rate_limited=self.rate_limiter.limited)
+
+
+admission_middleware = AdmissionMiddleware()
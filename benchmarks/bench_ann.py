@@ -0,0 +1,80 @@
+"""
+Compares the knowledgebase index types (flat, ivf, hnsw, ivfpq) on a synthetic corpus generated offline:
+build time, index memory, p50/p99 single-query latency and recall@k against the exact flat baseline.
+
+The corpus is a mixture of gaussian clusters of unit vectors, which is closer to sentence embeddings
+than uniform noise. Queries are perturbed corpus rows.
+
+    python benchmarks/bench_ann.py --rows 50000 --queries 1000 --k 3
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embeddings import EMBEDDING_DIM, INDEX_TYPES, create_index  # noqa: E402
+
+
+def generate_corpus(rows, queries, dim=EMBEDDING_DIM, clusters=256, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dim)).astype('float32')
+    corpus = centers[rng.integers(0, clusters, rows)] + 0.35 * rng.standard_normal((rows, dim)).astype('float32')
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    picked = corpus[rng.integers(0, rows, queries)]
+    query_vectors = picked + 0.05 * rng.standard_normal((queries, dim)).astype('float32')
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+    return np.ascontiguousarray(corpus), np.ascontiguousarray(query_vectors)
+
+
+def recall_at_k(found, truth):
+    hits = sum(len(set(row_found) & set(row_truth)) for row_found, row_truth in zip(found, truth))
+    return hits / truth.size
+
+
+def bench(index_type, corpus, queries, k):
+    start = perf_counter()
+    index = create_index(index_type, corpus)
+    build_time = perf_counter() - start
+    memory = faiss.serialize_index(index).nbytes
+
+    latencies = []
+    found = np.empty((len(queries), k), dtype='int64')
+    for i, query in enumerate(queries):
+        start = perf_counter()
+        _, indices = index.search(query.reshape(1, -1), k)
+        latencies.append(perf_counter() - start)
+        found[i] = indices[0]
+    latencies = np.asarray(latencies) * 1e6
+    return type(index).__name__, build_time, memory, np.percentile(latencies, 50), np.percentile(latencies, 99), found
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=50000)
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=3)
+    parser.add_argument('--types', nargs='*', default=list(INDEX_TYPES))
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    corpus, queries = generate_corpus(args.rows, args.queries, seed=args.seed)
+    flat = faiss.IndexFlatL2(EMBEDDING_DIM)
+    flat.add(corpus)
+    _, truth = flat.search(queries, args.k)
+
+    print(f"rows={args.rows} queries={args.queries} k={args.k}")
+    print(f"{'type':<8}{'index':<16}{'build s':>10}{'memory MB':>12}{'p50 us':>10}{'p99 us':>10}"
+          f"{'recall@' + str(args.k):>11}")
+    for index_type in args.types:
+        name, build_time, memory, p50, p99, found = bench(index_type, corpus, queries, args.k)
+        print(f"{index_type:<8}{name:<16}{build_time:>10.2f}{memory / 2 ** 20:>12.1f}{p50:>10.1f}{p99:>10.1f}"
+              f"{recall_at_k(found, truth):>11.3f}")
+
+
+if __name__ == '__main__':
+    main()
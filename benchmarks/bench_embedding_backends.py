@@ -0,0 +1,129 @@
+"""
+Compares the embedding backends (torch, onnx, onnx-int8) on CPU: load time, per-query latency,
+batch throughput, RSS and nearest-neighbour agreement with the PyTorch model on the knowledgebase csvs.
+
+Every backend runs in its own subprocess so its RSS is measured in isolation. Agreement is the share of
+queries (the FAQ questions and the labeled paraphrases) whose top-1 FAQ row is the same as with torch.
+
+    python benchmarks/bench_embedding_backends.py [--backends torch onnx onnx-int8] [--queries 500]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+from time import perf_counter
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def get_rss_mb():
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith('VmRSS:'):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def load_corpus():
+    import pandas as pd
+    from embeddings import list_knowledgebases, get_knowledgebase_file_path, read_faq
+
+    corpus = {}
+    for knowledgebase in list_knowledgebases():
+        faq, _ = read_faq(get_knowledgebase_file_path(knowledgebase))
+        queries = [question.lower() for question in faq]
+        paraphrases = os.path.join(ROOT, 'prompts', knowledgebase.lower(), f'{knowledgebase}-paraphrases.csv')
+        if os.path.exists(paraphrases):
+            queries += list(pd.read_csv(paraphrases, sep=';', keep_default_na=False)['Paraphrase'])
+        corpus[knowledgebase] = (faq, queries)
+    return corpus
+
+
+def run_backend(backend, queries_count):
+    # Runs in the subprocess, prints one json line of results.
+    os.environ['EMBEDDING_BACKEND'] = backend
+    from embeddings import load_embedding_model
+
+    rss_before = get_rss_mb()
+    start = perf_counter()
+    model = load_embedding_model(backend)
+    load_time = perf_counter() - start
+
+    start = perf_counter()
+    model.encode('hello')
+    first_query = perf_counter() - start
+
+    corpus = load_corpus()
+    sentences = [query for _, queries in corpus.values() for query in queries]
+    latencies = []
+    for i in range(queries_count):
+        start = perf_counter()
+        model.encode(sentences[i % len(sentences)])
+        latencies.append(perf_counter() - start)
+
+    batch = (sentences * (1 + 1024 // len(sentences)))[:1024]
+    start = perf_counter()
+    model.encode(batch, batch_size=64)
+    throughput = len(batch) / (perf_counter() - start)
+
+    neighbours = {}
+    for knowledgebase, (faq, queries) in corpus.items():
+        faq_vectors = model.encode(list(faq), normalize_embeddings=True)
+        query_vectors = model.encode(queries, normalize_embeddings=True)
+        neighbours[knowledgebase] = np.argmax(query_vectors @ faq_vectors.T, axis=1).tolist()
+
+    latencies = np.asarray(latencies) * 1000
+    print(json.dumps({
+        'backend': backend,
+        'load_s': load_time,
+        'first_query_ms': first_query * 1000,
+        'p50_ms': float(np.percentile(latencies, 50)),
+        'p99_ms': float(np.percentile(latencies, 99)),
+        'throughput': throughput,
+        'rss_mb': get_rss_mb() - rss_before,
+        'neighbours': neighbours,
+    }))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--backends', nargs='*', default=['torch', 'onnx', 'onnx-int8'])
+    parser.add_argument('--queries', type=int, default=500)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        return run_backend(args.child, args.queries)
+
+    results = {}
+    for backend in args.backends:
+        output = subprocess.run([sys.executable, __file__, '--child', backend, '--queries', str(args.queries)],
+                                capture_output=True, text=True, cwd=ROOT,
+                                env=dict(os.environ, TOKENIZERS_PARALLELISM='false'))
+        if output.returncode != 0:
+            print(f"{backend}: failed\n{output.stderr.strip().splitlines()[-1] if output.stderr else ''}")
+            continue
+        results[backend] = json.loads(output.stdout.strip().splitlines()[-1])
+
+    reference = results.get('torch')
+    print(f"{'backend':<11}{'load s':>8}{'1st ms':>9}{'p50 ms':>9}{'p99 ms':>9}{'sent/s':>9}{'RSS MB':>9}"
+          f"{'NN agree':>10}")
+    for backend, result in results.items():
+        agreement = float('nan')
+        if reference is not None:
+            same = total = 0
+            for knowledgebase, neighbours in result['neighbours'].items():
+                reference_neighbours = reference['neighbours'][knowledgebase]
+                same += sum(a == b for a, b in zip(neighbours, reference_neighbours))
+                total += len(neighbours)
+            agreement = same / total if total else float('nan')
+        print(f"{backend:<11}{result['load_s']:>8.2f}{result['first_query_ms']:>9.1f}{result['p50_ms']:>9.2f}"
+              f"{result['p99_ms']:>9.2f}{result['throughput']:>9.0f}{result['rss_mb']:>9.0f}{agreement:>10.1%}")
+
+
+if __name__ == '__main__':
+    main()
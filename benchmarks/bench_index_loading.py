@@ -0,0 +1,72 @@
+"""
+Per-query latency of reading the FAISS index from disk on every query (the old behaviour) against
+Knowledgebase.search, which keeps the index in memory and checks its meta and delta file for changes every
+INDEX_CHECK_INTERVAL seconds (also measured with a check on every query), optionally memory-mapped.
+The index must already be built (python build_indexes.py).
+
+    python benchmarks/bench_index_loading.py --knowledgebase Bank --queries 2000
+"""
+import argparse
+import os
+import sys
+from time import perf_counter
+
+import faiss
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import config  # noqa: E402
+from embeddings import (EMBEDDING_DIM, Knowledgebase, get_index_file_path, get_knowledgebase_file_path,  # noqa: E402
+                        prepare_vectors)
+
+
+def percentile(samples, q):
+    return float(np.percentile(np.asarray(samples) * 1e6, q))
+
+
+def run(label, search, queries):
+    samples = []
+    for query in queries:
+        start = perf_counter()
+        search(query)
+        samples.append(perf_counter() - start)
+    print(f"{label:<26} p50={percentile(samples, 50):9.1f}us  p99={percentile(samples, 99):9.1f}us  "
+          f"mean={np.mean(samples) * 1e6:9.1f}us")
+
+
+def load_knowledgebase(name, mmap):
+    config.FAISS_MMAP = mmap  # Read by Knowledgebase.load.
+    return Knowledgebase(name, get_knowledgebase_file_path(name), get_index_file_path(name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--knowledgebase', default='Bank')
+    parser.add_argument('--queries', type=int, default=1000)
+    parser.add_argument('--k', type=int, default=3)
+    args = parser.parse_args()
+
+    index_path = get_index_file_path(args.knowledgebase)
+    rng = np.random.default_rng(0)
+    queries = [prepare_vectors(query) for query in rng.standard_normal((args.queries, 1, EMBEDDING_DIM))]
+
+    run('read_index per query', lambda q: faiss.read_index(index_path).search(q, args.k), queries)
+
+    interval = config.INDEX_CHECK_INTERVAL
+    kb = load_knowledgebase(args.knowledgebase, mmap=False)
+    run('knowledgebase', lambda q: kb.search(q, args.k), queries)
+    config.INDEX_CHECK_INTERVAL = 0
+    run('knowledgebase (check 0s)', lambda q: kb.search(q, args.k), queries)
+    config.INDEX_CHECK_INTERVAL = interval
+
+    try:
+        mmap_kb = load_knowledgebase(args.knowledgebase, mmap=True)
+    except RuntimeError as e:  # Not every index type supports IO_FLAG_MMAP on every faiss build.
+        print(f"{'knowledgebase (mmap)':<26} skipped: {e}")
+        return
+    run('knowledgebase (mmap)', lambda q: mmap_kb.search(q, args.k), queries)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,232 @@
+"""
+End-to-end load test of one bot process, fully offline. Synthetic telegram updates of N simulated users go
+straight into the dispatcher built by ChatBot.setup_dispatcher; the Bot API is replaced by a fake session and
+Ollama by the local fake server, both with configurable latency. Every user runs /start, /type, 1, /run and
+then `--turns` attack messages. Reports throughput, p50/p95/p99 reply latency, event loop lag and RSS.
+
+    python benchmarks/bench_load.py --users 2000 --concurrency 200 --turns 5 --telegram-latency 0.05
+
+The SentenceTransformer model and the knowledgebase indexes must already be on disk (python build_indexes.py).
+"""
+import argparse
+import asyncio
+import logging
+import os
+import resource
+import sys
+import tempfile
+from collections import Counter
+from datetime import datetime
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiogram import Bot  # noqa: E402
+from aiogram.client.session.base import BaseSession  # noqa: E402
+from aiogram.methods import EditMessageText, SendMessage  # noqa: E402
+from aiogram.types import Message  # noqa: E402
+
+from benchmarks.fake_ollama import FakeOllama, start_fake_ollama  # noqa: E402
+
+FAKE_TOKEN = '123456:load-test'
+ATTACK_MESSAGES = [
+    "hello who is this",
+    "why are you calling me",
+    "what happened to my account",
+    "how do i know you are really from the bank",
+    "can you call me back later",
+    "what do you need from me",
+    "i did not make any transfer",
+    "is my money safe",
+]
+
+
+class FakeTelegramSession(BaseSession):
+    """
+    Bot API stand-in: every call sleeps `latency` seconds, sent and edited messages are echoed back.
+    """
+
+    def __init__(self, latency=0.05):
+        super().__init__()
+        self.latency = latency
+        self.calls = Counter()
+        self.message_id = 0
+
+    async def make_request(self, bot, method, timeout=None):
+        await asyncio.sleep(self.latency)
+        self.calls[type(method).__name__] += 1
+        if isinstance(method, (SendMessage, EditMessageText)):
+            self.message_id += 1
+            return Message.model_validate({
+                'message_id': getattr(method, 'message_id', None) or self.message_id,
+                'date': datetime.now(),
+                'chat': {'id': method.chat_id, 'type': 'private'},
+                'text': method.text,
+            }, context={'bot': bot})
+        return True
+
+    async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+        yield b''
+
+    async def close(self):
+        pass
+
+
+def get_rss_mb():
+    # Current resident set size, from /proc where available.
+    try:
+        with open('/proc/self/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_update(update_id, user_id, text):
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(datetime.now().timestamp()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'user{user_id}'},
+            'text': text,
+        },
+    }
+
+
+class LoadTest(object):
+    def __init__(self, dispatcher, bot, turns):
+        self.dispatcher = dispatcher
+        self.bot = bot
+        self.turns = turns
+        self.update_id = 0
+        self.latencies = {'command': [], 'attack': []}
+        self.errors = 0
+
+    async def send(self, user_id, text, kind):
+        self.update_id += 1
+        start = perf_counter()
+        try:
+            await self.dispatcher.feed_raw_update(self.bot, make_update(self.update_id, user_id, text))
+        except Exception:
+            self.errors += 1
+            return
+        self.latencies[kind].append(perf_counter() - start)
+
+    async def run_user(self, user_id):
+        for command in ('/start', '/type', '1', '/run'):
+            await self.send(user_id, command, 'command')
+        for turn in range(self.turns):
+            await self.send(user_id, ATTACK_MESSAGES[(user_id + turn) % len(ATTACK_MESSAGES)], 'attack')
+
+
+async def monitor_loop_lag(samples, interval=0.01):
+    while True:
+        start = perf_counter()
+        await asyncio.sleep(interval)
+        samples.append(perf_counter() - start - interval)
+
+
+def report_latency(label, samples):
+    if not samples:
+        print(f"{label:<16} no samples")
+        return
+    values = np.asarray(samples) * 1000
+    print(f"{label:<16} n={len(values):6d}  p50={np.percentile(values, 50):8.1f}ms  "
+          f"p95={np.percentile(values, 95):8.1f}ms  p99={np.percentile(values, 99):8.1f}ms")
+
+
+async def run(args):
+    fake = FakeOllama(prefill_delay=args.prefill_delay, token_delay=args.token_delay)
+    runner, base_url = await start_fake_ollama(fake)
+
+    import chatbot_server  # Imported here, after main() has set the environment read by config.
+    from ollama_client import ollama_client
+
+    ollama_client.base_url = base_url
+    chatbot = chatbot_server.ChatBot()
+    try:
+        await run_load_test(chatbot_server, chatbot.setup_dispatcher(), fake, args)
+    finally:
+        # Stops the learner thread and flushes the transcripts, or the process would never exit.
+        await chatbot.close()
+        await runner.cleanup()
+
+
+async def run_load_test(chatbot_server, dispatcher, fake, args):
+    session = FakeTelegramSession(latency=args.telegram_latency)
+    bot = Bot(token=FAKE_TOKEN, session=session)
+
+    rss_start = get_rss_mb()
+    warmup_start = perf_counter()
+    chatbot_server.transcript_writer.start()
+    await chatbot_server.wait_until_ready()
+    print(f"warmup {perf_counter() - warmup_start:.2f}s, rss {rss_start:.0f}MB -> {get_rss_mb():.0f}MB")
+
+    load_test = LoadTest(dispatcher, bot, args.turns)
+    lag = []
+    lag_task = asyncio.get_running_loop().create_task(monitor_loop_lag(lag))
+    semaphore = asyncio.Semaphore(args.concurrency)
+    peak_rss = get_rss_mb()
+
+    async def simulated_user(user_id):
+        nonlocal peak_rss
+        async with semaphore:
+            await load_test.run_user(user_id)
+            peak_rss = max(peak_rss, get_rss_mb())
+
+    start = perf_counter()
+    await asyncio.gather(*(simulated_user(1000 + index) for index in range(args.users)))
+    elapsed = perf_counter() - start
+    lag_task.cancel()
+
+    updates = sum(len(samples) for samples in load_test.latencies.values())
+    print(f"users={args.users} concurrency={args.concurrency} turns={args.turns} "
+          f"telegram={args.telegram_latency * 1000:.0f}ms prefill={args.prefill_delay * 1000:.0f}ms "
+          f"token={args.token_delay * 1000:.0f}ms")
+    print(f"{updates} updates in {elapsed:.2f}s: {updates / elapsed:.1f} updates/s, "
+          f"{len(load_test.latencies['attack']) / elapsed:.1f} attack turns/s, errors={load_test.errors}")
+    report_latency('commands', load_test.latencies['command'])
+    report_latency('attack turns', load_test.latencies['attack'])
+    report_latency('event loop lag', lag)
+    print(f"rss peak {peak_rss:.0f}MB, end {get_rss_mb():.0f}MB")
+    print(f"ollama requests={len(fake.requests)} telegram calls={dict(session.calls)}")
+    print(f"admission {chatbot_server.admission_middleware.stats()}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--concurrency', type=int, default=100, help='simulated users talking at the same time')
+    parser.add_argument('--turns', type=int, default=5, help='attack messages per user after /run')
+    parser.add_argument('--telegram-latency', type=float, default=0.05)
+    parser.add_argument('--prefill-delay', type=float, default=0.05)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    args = parser.parse_args()
+
+    # Offline and self-contained: in-memory sessions, scratch files, no metrics port, and limits that
+    # do not throttle the simulated users unless they are set explicitly.
+    scratch = tempfile.mkdtemp(prefix='bench_load-')
+    os.environ.setdefault('HF_HUB_OFFLINE', '1')
+    os.environ.setdefault('SESSION_BACKEND', 'memory')
+    os.environ.setdefault('FSM_STORAGE', 'memory')
+    os.environ.setdefault('METRICS_PORT', '0')
+    os.environ.setdefault('STARTUP_MODE', 'eager')
+    os.environ.setdefault('TRANSCRIPT_DIR', os.path.join(scratch, 'transcripts'))
+    os.environ.setdefault('SAMPLES_PATH', os.path.join(scratch, 'samples.jsonl'))
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ.setdefault('USER_RATE', '1000')
+    os.environ.setdefault('USER_BURST', '1000')
+    os.environ.setdefault('MAX_GENERATIONS', str(args.concurrency))
+    os.environ.setdefault('GENERATION_QUEUE_SIZE', str(args.concurrency))
+    logging.basicConfig(level=os.environ['LOG_LEVEL'])
+    asyncio.run(run(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,60 @@
+"""
+Time to first token against time to full answer of the async Ollama client, served by the local
+fake Ollama server, with N concurrent generations sharing the pooled session.
+
+    python benchmarks/bench_ollama_streaming.py --concurrency 32 --token-delay 0.02
+"""
+import argparse
+import asyncio
+import os
+import sys
+from time import perf_counter
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_ollama import FakeOllama, start_fake_ollama  # noqa: E402
+from ollama_client import AsyncOllamaClient  # noqa: E402
+
+
+async def one_generation(client, prompt):
+    start = perf_counter()
+    first_token = []
+
+    async def on_token(token):
+        if not first_token:
+            first_token.append(perf_counter() - start)
+
+    text, stats = await client.generate(prompt, on_token=on_token)
+    assert text and stats.get('done'), 'the fake server must return a complete answer'
+    return first_token[0], perf_counter() - start
+
+
+async def run(args):
+    fake = FakeOllama(prefill_delay=args.prefill_delay, token_delay=args.token_delay)
+    runner, base_url = await start_fake_ollama(fake)
+    client = AsyncOllamaClient(base_url=base_url, pool_size=args.pool_size)
+    try:
+        results = await asyncio.gather(*(one_generation(client, f'prompt {i}') for i in range(args.concurrency)))
+    finally:
+        await client.close()
+        await runner.cleanup()
+
+    ttft, total = (np.asarray(values) * 1000 for values in zip(*results))
+    print(f"requests={args.concurrency} pool={args.pool_size}")
+    print(f"time to first token  p50={np.percentile(ttft, 50):8.1f}ms  p99={np.percentile(ttft, 99):8.1f}ms")
+    print(f"time to full answer  p50={np.percentile(total, 50):8.1f}ms  p99={np.percentile(total, 99):8.1f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--pool-size', type=int, default=16)
+    parser.add_argument('--prefill-delay', type=float, default=0.05)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
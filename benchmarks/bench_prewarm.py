@@ -0,0 +1,83 @@
+"""
+First-reply latency of an attack with and without the /run prewarm, against the local fake Ollama with
+cold costs (model load, uncached prompt prefill). Each attack type is run with the model unloaded: the
+first client message comes `--think-time` seconds after /run, followed by `--turns - 1` more turns.
+
+    python benchmarks/bench_prewarm.py --load-delay 2 --prefill-per-word 0.003 --think-time 1.5
+"""
+import argparse
+import asyncio
+import os
+import sys
+from time import perf_counter, strftime
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fake_ollama import FakeOllama, start_fake_ollama  # noqa: E402
+from ollama_client import AsyncOllamaClient  # noqa: E402
+from prewarm import Prewarmer, get_prompt_prefix  # noqa: E402
+from prompts.prompts import prompt_registry  # noqa: E402
+
+CLIENT_MESSAGES = ["hello who is this", "what happened", "why do you need that", "ok let me check", "fine"]
+
+
+async def run_attack(client, fake, prewarmer, attack_type, args):
+    template = prompt_registry.get_role(attack_type)
+    inputs = {'name': 'Donald', 'time': strftime('%H:%M')}
+    history = [f"assistant: Hello Donald, its Jason from {attack_type}."]
+
+    fake.unload()
+    if prewarmer is not None:
+        prewarmer.prewarm(attack_type, get_prompt_prefix(template, **inputs))
+    await asyncio.sleep(args.think_time)  # The client reads the intro message.
+
+    latencies = []
+    for turn in range(args.turns):
+        message = CLIENT_MESSAGES[turn % len(CLIENT_MESSAGES)]
+        history.append(f"user: {message}")
+        prompt = template.format(history="\n".join(history), context=f"Client: {message}", **inputs)
+        start = perf_counter()
+        answer, _ = await client.generate(prompt, options={'num_predict': args.num_predict})
+        latencies.append(perf_counter() - start)
+        history.append(f"assistant: {answer.strip()}")
+    return latencies
+
+
+async def run(args):
+    fake = FakeOllama(prefill_delay=args.prefill_delay, token_delay=args.token_delay, load_delay=args.load_delay,
+                      prefill_per_word=args.prefill_per_word)
+    runner, base_url = await start_fake_ollama(fake)
+    client = AsyncOllamaClient(base_url=base_url)
+    try:
+        for label, prewarmer in (('cold', None), ('prewarmed', Prewarmer(client=client, interval=0))):
+            first, later = [], []
+            for attack_type in prompt_registry.roles:
+                if attack_type == 'Zoom':  # Not an attack type of the bot, its role needs extra inputs.
+                    continue
+                latencies = await run_attack(client, fake, prewarmer, attack_type, args)
+                first.append(latencies[0])
+                later.extend(latencies[1:])
+            print(f"{label:<10} first reply mean={np.mean(first) * 1000:8.1f}ms  "
+                  f"later turns mean={np.mean(later) * 1000 if later else 0.0:8.1f}ms")
+    finally:
+        await client.close()
+        await runner.cleanup()
+    print(f"model loads={fake.loads} requests={len(fake.requests)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--turns', type=int, default=4)
+    parser.add_argument('--think-time', type=float, default=1.5)
+    parser.add_argument('--load-delay', type=float, default=1.0)
+    parser.add_argument('--prefill-delay', type=float, default=0.02)
+    parser.add_argument('--prefill-per-word', type=float, default=0.003)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--num-predict', type=int, default=8)
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
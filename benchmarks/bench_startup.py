@@ -0,0 +1,65 @@
+"""
+Startup cost of the bot: import time of chatbot_server (via python -X importtime) and the time until
+the ChatBot and its dispatcher exist, i.e. until polling could start. The models load afterwards in
+the background unless STARTUP_MODE=eager.
+
+    python benchmarks/bench_startup.py --top 15
+"""
+import argparse
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+READY_SCRIPT = """
+from time import perf_counter
+start = perf_counter()
+import chatbot_server
+from aiogram import Router
+imported = perf_counter()
+chatbot = chatbot_server.ChatBot()
+chatbot_server.create_dispatcher(Router())
+ready = perf_counter()
+print(f"{imported - start:.6f} {ready - start:.6f}")
+"""
+
+
+def parse_importtime(stderr):
+    # Lines look like: "import time:       self [us] |  cumulative | imported package"
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        _, self_us, cumulative_us, name = [part.strip() for part in line.replace('import time:', '|', 1).split('|')]
+        modules.append((name, int(self_us), int(cumulative_us)))
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    result = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import chatbot_server'],
+                            cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else 'import failed')
+        sys.exit(result.returncode)
+
+    modules = parse_importtime(result.stderr)
+    total = sum(self_us for _, self_us, _ in modules)
+    print(f"import chatbot_server: {total / 1e3:.1f}ms over {len(modules)} modules")
+    for name, self_us, cumulative_us in sorted(modules, key=lambda module: -module[2])[:args.top]:
+        print(f"  {cumulative_us / 1e3:9.1f}ms cumulative {self_us / 1e3:8.1f}ms self  {name.strip()}")
+
+    result = subprocess.run([sys.executable, '-c', READY_SCRIPT], cwd=ROOT, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(result.stderr.splitlines()[-1] if result.stderr else 'startup failed')
+        sys.exit(result.returncode)
+    imported, ready = [float(value) for value in result.stdout.split()[-2:]]
+    print(f"time to import: {imported * 1e3:.1f}ms  time to dispatcher ready: {ready * 1e3:.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,164 @@
+"""
+Local stand-in for the Ollama HTTP API (/api/generate, /api/chat is not needed by the bot).
+Streams a canned answer token by token with a configurable load/prefill/per-token latency,
+so the async client, streaming replies and load tests can run fully offline.
+
+Cold and warm costs are simulated like Ollama: the model is loaded (`load_delay`) on the first request and
+after `keep_alive` seconds without requests, and only the prompt words after the prefix shared with the
+previous prompt pay `prefill_per_word`. An empty prompt only loads the model.
+
+    python benchmarks/fake_ollama.py --port 11434 --token-delay 0.02 --load-delay 2 --prefill-per-word 0.002
+"""
+import argparse
+import asyncio
+import json
+from time import monotonic, monotonic_ns
+
+from aiohttp import web
+
+DEFAULT_ANSWER = "Hello this is Jason from the bank can you confirm your account number please"
+DURATION_UNITS = {'ms': 0.001, 's': 1, 'm': 60, 'h': 3600}
+
+
+def parse_keep_alive(value, default=300.0):
+    # Ollama accepts seconds or a duration string ("30m"), a negative value keeps the model forever.
+    if value is None or value == '':
+        return default
+    if isinstance(value, str):
+        for unit in sorted(DURATION_UNITS, key=len, reverse=True):
+            if value.endswith(unit) and value[:-len(unit)].lstrip('-').replace('.', '', 1).isdigit():
+                value = float(value[:-len(unit)]) * DURATION_UNITS[unit]
+                break
+    value = float(value)
+    return float('inf') if value < 0 else value
+
+
+def count_shared_words(words, cached):
+    shared = 0
+    for word, cached_word in zip(words, cached):
+        if word != cached_word:
+            break
+        shared += 1
+    return shared
+
+
+class FakeOllama(object):
+    def __init__(self, answer=DEFAULT_ANSWER, prefill_delay=0.05, token_delay=0.02, load_delay=0.0,
+                 prefill_per_word=0.0):
+        self.answer = answer
+        self.prefill_delay = prefill_delay
+        self.token_delay = token_delay
+        self.load_delay = load_delay
+        self.prefill_per_word = prefill_per_word
+        self.requests = []
+        self.loaded_until = 0.0
+        self.cached_words = []
+        self.loads = 0
+
+    def unload(self):
+        self.loaded_until = 0.0
+        self.cached_words = []
+
+    async def load(self, payload):
+        # Returns the load duration in nanoseconds, 0 when the model was still loaded.
+        start = monotonic_ns()
+        if monotonic() >= self.loaded_until:
+            self.cached_words = []
+            self.loads += 1
+            await asyncio.sleep(self.load_delay)
+        self.loaded_until = monotonic() + parse_keep_alive(payload.get('keep_alive'))
+        return monotonic_ns() - start
+
+    async def prefill(self, prompt):
+        words = prompt.split()
+        shared = count_shared_words(words, self.cached_words)
+        self.cached_words = words
+        await asyncio.sleep(self.prefill_delay + self.prefill_per_word * (len(words) - shared))
+
+    def get_tokens(self, payload):
+        tokens = [f'{word} ' for word in self.answer.split()]
+        num_predict = (payload.get('options') or {}).get('num_predict')
+        if num_predict and num_predict > 0:
+            tokens = tokens[:num_predict]
+        return tokens
+
+    async def generate(self, request):
+        payload = await request.json()
+        self.requests.append(payload)
+        load_duration = await self.load(payload)
+        if not payload.get('prompt'):
+            return web.json_response({'model': payload.get('model'), 'response': '', 'done': True,
+                                      'done_reason': 'load', 'load_duration': load_duration})
+
+        start = monotonic_ns()
+        tokens = self.get_tokens(payload)
+
+        await self.prefill(payload['prompt'])
+        prompt_eval_duration = monotonic_ns() - start
+
+        final = {
+            'model': payload.get('model'),
+            'done': True,
+            'load_duration': load_duration,
+            'prompt_eval_count': len(payload.get('prompt', '').split()),
+            'prompt_eval_duration': prompt_eval_duration,
+            'eval_count': len(tokens),
+        }
+
+        if not payload.get('stream', True):
+            await asyncio.sleep(self.token_delay * len(tokens))
+            final.update(response=''.join(tokens), eval_duration=monotonic_ns() - start - prompt_eval_duration,
+                         total_duration=monotonic_ns() - start)
+            return web.json_response(final)
+
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        for token in tokens:
+            await asyncio.sleep(self.token_delay)
+            await response.write(json.dumps({'model': payload.get('model'), 'response': token,
+                                             'done': False}).encode() + b'\n')
+        final.update(response='', eval_duration=monotonic_ns() - start - prompt_eval_duration,
+                     total_duration=monotonic_ns() - start)
+        await response.write(json.dumps(final).encode() + b'\n')
+        await response.write_eof()
+        return response
+
+    async def health(self, request):
+        return web.Response(text='Ollama is running')
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_get('/', self.health)
+        app.router.add_post('/api/generate', self.generate)
+        return app
+
+
+async def start_fake_ollama(fake, host='127.0.0.1', port=0):
+    """
+    Starts `fake` in the running loop. Returns (runner, base_url), call `await runner.cleanup()` when done.
+    """
+    runner = web.AppRunner(fake.create_app())
+    await runner.setup()
+    site = web.TCPSite(runner, host, port)
+    await site.start()
+    bound_port = site._server.sockets[0].getsockname()[1]
+    return runner, f'http://{host}:{bound_port}'
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=11434)
+    parser.add_argument('--prefill-delay', type=float, default=0.05)
+    parser.add_argument('--token-delay', type=float, default=0.02)
+    parser.add_argument('--load-delay', type=float, default=0.0)
+    parser.add_argument('--prefill-per-word', type=float, default=0.0)
+    args = parser.parse_args()
+
+    fake = FakeOllama(prefill_delay=args.prefill_delay, token_delay=args.token_delay, load_delay=args.load_delay,
+                      prefill_per_word=args.prefill_per_word)
+    web.run_app(fake.create_app(), host=args.host, port=args.port)
+
+
+if __name__ == '__main__':
+    main()
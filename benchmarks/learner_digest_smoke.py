@@ -0,0 +1,72 @@
+"""
+Runs the learner digest against a local aiosmtpd stand-in (pip install aiosmtpd), fully offline:
+queues duplicated samples, checks the store de-duplicates them, that one SMTP connection delivers the
+digest to every admin and that a second digest only contains the new samples.
+
+    python benchmarks/learner_digest_smoke.py
+"""
+import os
+import sys
+import tempfile
+from time import sleep
+
+from aiosmtpd.controller import Controller
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+class RecordingHandler(object):
+    def __init__(self):
+        self.messages = []
+        self.sessions = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.sessions.add(id(session))
+        self.messages.append((envelope.rcpt_tos, envelope.content.decode('utf8', errors='replace')))
+        return '250 Message accepted for delivery'
+
+
+def wait_for(predicate, timeout=10):
+    for _ in range(int(timeout / 0.05)):
+        if predicate():
+            return
+        sleep(0.05)
+    raise AssertionError('timed out')
+
+
+def main():
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=8025)
+    controller.start()
+    os.environ.update(MAIL_SERVER='127.0.0.1', MAIL_PORT='8025', MAIL_USE_SSL='0', MAIL_PASSWORD='')
+
+    from learner import Learner  # noqa: E402
+    from sample_store import SampleStore  # noqa: E402
+
+    with tempfile.TemporaryDirectory() as tmp:
+        learner = Learner(store=SampleStore(os.path.join(tmp, 'samples.jsonl')), digest_interval=3600)
+        try:
+            for question in ['who is this', 'who is this', 'what bank']:
+                learner.add_sample((question, 'Jason from the bank', 'Bank-knowledge.csv'))
+            wait_for(lambda: learner.store.stats()['added'] + learner.store.stats()['duplicates'] == 3)
+            assert learner.store.stats()['duplicates'] == 1, learner.stats()
+
+            assert learner.update_admin()
+            assert len(handler.messages) == len(learner.admins_mail)
+            assert len(handler.sessions) == 1, 'all admins must be mailed over one connection'
+
+            learner.add_sample(('are you a bot', 'No I am Jason', 'Bank-knowledge.csv'))
+            wait_for(lambda: learner.store.stats()['samples'] == 3)
+            assert learner.update_admin()
+            last_digest = handler.messages[-1][1]
+            assert 'are you a bot' in last_digest and 'what bank' not in last_digest
+
+            assert not learner.update_admin(), 'no digest without new samples'
+            print('learner digest ok', learner.stats())
+        finally:
+            learner.stop_active_learning()
+            controller.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,29 @@
+"""
+Pre-builds the FAISS index of every knowledgebase under prompts/*/ before the bot starts.
+An index is rebuilt only when the content of its *-knowledge.csv changed (use --force to rebuild anyway).
+
+    python build_indexes.py [--force] [--batch-size 64] [Bank Delivery ...]
+"""
+import argparse
+from time import time
+
+import config
+from embeddings import build_index, list_knowledgebases
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('knowledgebases', nargs='*', help='Knowledgebases to build (default: all of them).')
+    parser.add_argument('--force', action='store_true', help='Rebuild even if the csv did not change.')
+    parser.add_argument('--batch-size', type=int, default=config.EMBEDDING_BATCH_SIZE)
+    args = parser.parse_args()
+
+    for knowledgebase in args.knowledgebases or list_knowledgebases():
+        start = time()
+        rebuilt = build_index(knowledgebase, batch_size=args.batch_size, force=args.force)
+        status = 'built' if rebuilt else 'up to date'
+        print(f"{knowledgebase}: {status} ({time() - start:.2f}s)")
+
+
+if __name__ == '__main__':
+    main()
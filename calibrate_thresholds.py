@@ -0,0 +1,111 @@
+"""
+Picks per-knowledgebase FAQ thresholds from a labeled paraphrase set and reports the FAQ hit rate.
+
+prompts/<type>/<Type>-paraphrases.csv holds "Paraphrase";"Question" rows, where Question is the FAQ question
+the paraphrase should be answered with, or empty when it must fall through to the LLM.
+For every knowledgebase the answer threshold that maximizes the FAQ hit rate while keeping wrong FAQ answers
+under --max-wrong is kept; the active learning threshold is the score beyond which only --learn-quantile of
+the labeled paraphrases fall. Results are written to indexes/thresholds.json with --write.
+
+    python calibrate_thresholds.py [--write] [--max-wrong 0.05] [Bank Delivery ...]
+"""
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+import config
+from embeddings import (encode_queries, get_thresholds_file_path, is_close, is_cosine, knowledgebase_registry,
+                        list_knowledgebases, load_thresholds)
+
+
+def get_paraphrases_file_path(knowledgebase):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', knowledgebase.lower(),
+                        f'{knowledgebase}-paraphrases.csv')
+
+
+def score_paraphrases(knowledgebase):
+    # Top-1 FAQ question and score of every paraphrase, next to its label.
+    df = pd.read_csv(get_paraphrases_file_path(knowledgebase), sep=';', keep_default_na=False)
+    kb = knowledgebase_registry.get(knowledgebase)
+    indices, scores = kb.search(encode_queries([text.lower() for text in df['Paraphrase']]), 1)
+    predicted = [kb.faq[i] if i >= 0 else None for i in indices[:, 0]]
+    return scores[:, 0], predicted, list(df['Question'])
+
+
+def evaluate(threshold, scores, predicted, labels):
+    answered = np.array([is_close(score, threshold) for score in scores])
+    correct = np.array([label != '' and label == question for question, label in zip(predicted, labels)])
+    in_kb = sum(1 for label in labels if label)
+    return {
+        'hit_rate': float((answered & correct).sum() / in_kb) if in_kb else 0.0,
+        'wrong_rate': float((answered & ~correct).sum() / len(labels)),
+    }
+
+
+def calibrate(scores, predicted, labels, max_wrong, learn_quantile):
+    # Candidate thresholds lie halfway between consecutive observed scores.
+    ordered = np.unique(scores)
+    candidates = np.concatenate([[ordered[0] - 1e-3], (ordered[1:] + ordered[:-1]) / 2, [ordered[-1] + 1e-3]])
+    best_threshold, best = None, None
+    for threshold in candidates:
+        result = evaluate(threshold, scores, predicted, labels)
+        if result['wrong_rate'] > max_wrong:
+            continue
+        if best is None or (result['hit_rate'], -result['wrong_rate']) > (best['hit_rate'], -best['wrong_rate']):
+            best_threshold, best = float(threshold), result
+
+    labeled_scores = np.array([score for score, label in zip(scores, labels) if label])
+    if is_cosine():
+        learn_threshold = float(np.quantile(labeled_scores, learn_quantile))
+    else:
+        learn_threshold = float(np.quantile(labeled_scores, 1 - learn_quantile))
+    return best_threshold, learn_threshold
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('knowledgebases', nargs='*')
+    parser.add_argument('--max-wrong', type=float, default=0.05, help='Max share of wrong FAQ answers.')
+    parser.add_argument('--learn-quantile', type=float, default=0.05)
+    parser.add_argument('--write', action='store_true', help='Save the thresholds to indexes/thresholds.json.')
+    args = parser.parse_args()
+
+    path = get_thresholds_file_path()
+    saved = {}
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            saved = json.load(f)
+
+    metric = config.INDEX_METRIC
+    names = args.knowledgebases or [name for name in list_knowledgebases()
+                                    if os.path.exists(get_paraphrases_file_path(name))]
+    print(f"metric={metric}")
+    for knowledgebase in names:
+        scores, predicted, labels = score_paraphrases(knowledgebase)
+        current = load_thresholds(knowledgebase, metric)
+        threshold, learn_threshold = calibrate(scores, predicted, labels, args.max_wrong, args.learn_quantile)
+        if threshold is None:
+            print(f"{knowledgebase}: no threshold keeps wrong answers under {args.max_wrong}")
+            continue
+
+        before = evaluate(current['answer'], scores, predicted, labels)
+        after = evaluate(threshold, scores, predicted, labels)
+        print(f"{knowledgebase}: answer threshold {current['answer']:.3f} -> {threshold:.3f}, "
+              f"FAQ hit rate {before['hit_rate']:.1%} -> {after['hit_rate']:.1%}, "
+              f"wrong answers {before['wrong_rate']:.1%} -> {after['wrong_rate']:.1%}, "
+              f"active learning threshold {current['active_learning']:.3f} -> {learn_threshold:.3f}")
+        saved.setdefault(knowledgebase, {})[metric] = {'answer': round(threshold, 4),
+                                                       'active_learning': round(learn_threshold, 4)}
+
+    if args.write:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as f:
+            json.dump(saved, f, indent=2, sort_keys=True)
+        print(f"thresholds written to {path}")
+
+
+if __name__ == '__main__':
+    main()
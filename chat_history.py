@@ -1,14 +1,100 @@
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_core.prompts import MessagesPlaceholder, ChatPromptTemplate, PromptTemplate
+from threading import Lock
 import os
 
+import config
+
+
+def estimate_tokens(text):
+    # Rough estimate (~4 characters per token), good enough for budgeting the prompt.
+    return len(text) // 4 + 1
+
+
+def format_messages(messages):
+    return "".join(f"{role}: {msg}\n" for role, msg in messages)
+
+
+class HistoryManager(object):
+    """
+    Bounded prompt history. The last `window_messages` messages are kept verbatim, older messages wait in
+    `pending` until a rolling summary that covers them is produced (off the hot path, see Llm.summarize_history).
+    Messages are folded in chunks, so the rendered history only grows between folds and the prompt prefix
+    stays the same from turn to turn, which lets Ollama reuse its cached prefix.
+    """
+
+    def __init__(self, window_messages=config.HISTORY_WINDOW_MESSAGES, token_budget=config.HISTORY_TOKEN_BUDGET):
+        self.window_messages = window_messages
+        self.token_budget = token_budget
+        self.summary = ''
+        self.pending = []
+        self.window = []
+        self._lock = Lock()
+
+    def add(self, role, msg):
+        with self._lock:
+            self.window.append((role, msg))
+            if len(self.window) > self.window_messages:
+                # Fold half of the window at once instead of sliding it by one message every turn.
+                cut = len(self.window) - self.window_messages // 2
+                self.pending.extend(self.window[:cut])
+                self.window = self.window[cut:]
+            self.enforce_budget()
+
+    def enforce_budget(self):
+        # Summaries are best effort, if they are late the oldest pending messages are dropped.
+        while self.pending and self.count_tokens() > self.token_budget:
+            self.pending.pop(0)
+
+    def count_tokens(self):
+        return estimate_tokens(self.summary) + estimate_tokens(format_messages(self.pending + self.window))
+
+    def needs_summary(self):
+        return bool(self.pending)
+
+    def get_pending(self):
+        with self._lock:
+            return list(self.pending)
+
+    def fold(self, summary, messages):
+        # Replaces the summarized pending `messages` (those not dropped meanwhile) by the new summary.
+        folded = {id(message) for message in messages}
+        with self._lock:
+            self.summary = summary.strip()
+            self.pending = [message for message in self.pending if id(message) not in folded]
+
+    def render(self):
+        with self._lock:
+            history = format_messages(self.pending + self.window)
+            if self.summary:
+                history = f"summary: {self.summary}\n" + history
+            return history
+
+    def get_state(self):
+        with self._lock:
+            return {'summary': self.summary, 'pending': list(self.pending), 'window': list(self.window)}
+
+    def set_state(self, state):
+        with self._lock:
+            self.summary = state.get('summary', '')
+            self.pending = [tuple(message) for message in state.get('pending', [])]
+            self.window = [tuple(message) for message in state.get('window', [])]
+
+    def clear(self):
+        with self._lock:
+            self.summary = ''
+            self.pending = []
+            self.window = []
+
 
 class chatHistory(object):
     def __init__(self, name='default'):
-        self.chat_history = []
+        self.chat_history = []  # Full transcript of the conversation.
+        self.history = HistoryManager()  # What goes into the prompt.
         self.role = None
         self.name = name
         self.directory = "chat_history"
+        self.saved_messages = 0  # Messages of chat_history already appended to the saved file.
 
     def set_profile_name_for_transcript(self, profile_name):
         self.name = profile_name
@@ -17,16 +103,19 @@ class chatHistory(object):
         if save_attack:
             self.save_chat()
         self.chat_history.clear()
+        self.saved_messages = 0
+        self.history.clear()
         self.role = None
 
     def save_chat(self):
         if not os.path.exists(self.directory):
             os.makedirs(self.directory)
 
+        # Append-only, only the messages added since the last save are written.
         file_path = os.path.join(self.directory, f'chat_history-{self.name}.txt')
-        with open(file_path, 'w') as f:
-            for role, prompt in self.chat_history:
-                f.write(f'{role}: {prompt}\n')
+        with open(file_path, 'a') as f:
+            f.writelines(f'{role}: {prompt}\n' for role, prompt in self.chat_history[self.saved_messages:])
+        self.saved_messages = len(self.chat_history)
 
     def initialize_role(self, role: SystemMessage):
         self.role = role
@@ -34,6 +123,7 @@ class chatHistory(object):
     def add_human_message(self, msg: str):
         message = ("user", f"{msg}")
         self.chat_history.append(message)
+        self.history.add(*message)
 
     def add_system_message(self, msg: str):
         self.chat_history.extend(SystemMessage(content=msg))
@@ -41,6 +131,7 @@ class chatHistory(object):
     def add_ai_response(self, res: str):
         msg = ("assistant", f"{res}")
         self.chat_history.append(msg)
+        self.history.add(*msg)
 
     def get_window(self):
         return self.chat_history[-1]
@@ -48,6 +139,16 @@ class chatHistory(object):
     def get_chat_history(self):
         return self.chat_history
 
+    def get_prompt_history(self):
+        return self.history.render()
+
+    def get_state(self):
+        return {'messages': list(self.chat_history), 'prompt_history': self.history.get_state()}
+
+    def set_state(self, state):
+        self.chat_history = [tuple(message) for message in state.get('messages', [])]
+        self.history.set_state(state.get('prompt_history', {}))
+
     def update_chat_history(self, user_message, ai_response):
         self.chat_history.extend([
             HumanMessage(content=user_message),
@@ -56,6 +157,3 @@ class chatHistory(object):
 
     def get_prompt(self):
         return self.role
-
-    def get_transcription(self):
-        return "\n".join(f"{role}: {msg}" for role, msg in self.chat_history) + "\n"
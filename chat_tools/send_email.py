@@ -7,10 +7,7 @@ from dotenv import load_dotenv
 load_dotenv()
 
 
-def send_email(email_receiver, display_name, email_subject, email_body, from_email=None):
-    email_sender = os.getenv('MAIL_USERNAME')
-    email_password = os.getenv('MAIL_PASSWORD')
-
+def build_email(email_sender, email_receiver, display_name, email_subject, email_body, from_email=None):
     em = EmailMessage()
     if from_email:
         em['from'] = f"{display_name} <{from_email}>"
@@ -20,8 +17,49 @@ def send_email(email_receiver, display_name, email_subject, email_body, from_ema
     em['to'] = email_receiver
     em['subject'] = email_subject
     em.set_content(email_body)
+    return em
+
+
+class EmailSender(object):
+    """
+    One SMTP connection reused for several emails:
+
+        with EmailSender() as sender:
+            sender.send(...)
+            sender.send(...)
+
+    MAIL_PORT (default 465) and MAIL_USE_SSL (default 1) allow a plain local SMTP server in development.
+    """
 
-    context = ssl.create_default_context()
-    with smtplib.SMTP_SSL(os.getenv('MAIL_SERVER'), 465, context=context) as smtp:
-        smtp.login(email_sender, email_password)
-        smtp.sendmail(email_sender, email_receiver, em.as_string())
+    def __init__(self, server=None, port=None, use_ssl=None):
+        self.server = server or os.getenv('MAIL_SERVER')
+        self.port = port or int(os.getenv('MAIL_PORT', 465))
+        self.use_ssl = use_ssl if use_ssl is not None else os.getenv('MAIL_USE_SSL', '1') == '1'
+        self.email_sender = os.getenv('MAIL_USERNAME')
+        self.email_password = os.getenv('MAIL_PASSWORD')
+        self.smtp = None
+
+    def __enter__(self):
+        if self.use_ssl:
+            self.smtp = smtplib.SMTP_SSL(self.server, self.port, context=ssl.create_default_context())
+        else:
+            self.smtp = smtplib.SMTP(self.server, self.port)
+        if self.email_password:
+            self.smtp.login(self.email_sender, self.email_password)
+        return self
+
+    def send(self, email_receiver, display_name, email_subject, email_body, from_email=None):
+        em = build_email(self.email_sender, email_receiver, display_name, email_subject, email_body, from_email)
+        self.smtp.sendmail(self.email_sender or from_email, email_receiver, em.as_string())
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        try:
+            self.smtp.quit()
+        except smtplib.SMTPException:
+            self.smtp.close()
+        self.smtp = None
+
+
+def send_email(email_receiver, display_name, email_subject, email_body, from_email=None):
+    with EmailSender() as sender:
+        sender.send(email_receiver, display_name, email_subject, email_body, from_email=from_email)
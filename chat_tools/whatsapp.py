@@ -1,6 +1,5 @@
 import pywhatkit
-from prompts.prompts import get_text_from_file
-import os
+from prompts.prompts import prompt_registry
 
 
 class WhatsAppBot(object):
@@ -18,6 +17,4 @@ class WhatsAppBot(object):
 
     @staticmethod
     def get_message_template(zoom_url, profile_name):
-        current_directory = os.path.dirname(__file__)
-        parent_directory = os.path.dirname(current_directory) + "\prompts\whatsapp_invitation.txt"
-        return get_text_from_file(parent_directory).format(zoom_url=zoom_url, name=profile_name, target='Hemi')
+        return prompt_registry.whatsapp_invitation.format(zoom_url=zoom_url, name=profile_name, target='Hemi')
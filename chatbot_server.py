@@ -2,33 +2,161 @@ import asyncio
 import logging
 from os import getenv
 from threading import Event
+from time import monotonic, perf_counter
 from typing import Any
 from models import User, Attack
 
 from aiogram import Bot, Dispatcher, F, Router
-from aiogram.filters import Command
+from aiogram.filters import Command, CommandObject
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.scene import Scene, SceneRegistry, ScenesManager, on
 from aiogram.fsm.storage.memory import SimpleEventIsolation
 from aiogram.types import Message
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 
 from dotenv import load_dotenv
-from learner import learner
-from llm import llm
+
+import config
+from admission import admission_middleware
+from fsm_storage import create_fsm_storage
+from metrics import handle_metrics, metrics, stage_latency, start_metrics_server
+from ollama_client import ollama_client
+from model_router import model_router
+from prewarm import prewarmer
+from rules import GENERAL_RULES, rule_registry
+from session_store import create_session_store
+from transcript_store import transcript_writer
+from workers import model_pool
 
 load_dotenv()
 
 TOKEN = getenv("DECEPTIFYBOT_TOKEN")
-users = {}
-
-
-def get_or_create_user(user):
-    # Checks if the user exists, if not, it will add the user to the dictionary.
-    user_id = user.id
-    if user_id not in users.keys():
-        users[user_id] = User(user_id=user_id,
-                              user_name=user.username if user.username else f"{user.first_name} {user.last_name}".strip())
-    return users[user_id]
+sessions = create_session_store()
+logger = logging.getLogger(__name__)
+
+
+warmup_task = None
+
+
+def load_components():
+    # Heavy imports (torch, langchain, faiss, pandas) and models, loaded on a worker thread so the
+    # command handlers answer while the bot warms up.
+    from embeddings import warmup_embedding_model
+    from learner import get_learner
+    from llm import get_general_llm
+
+    warmup_embedding_model()
+    get_general_llm()
+    get_learner()
+
+
+def start_warmup():
+    global warmup_task
+    if warmup_task is None:
+        warmup_task = asyncio.ensure_future(model_pool.run('warmup', load_components))
+    return warmup_task
+
+
+async def wait_until_ready():
+    # Handlers that need the models wait for the warmup, the other ones never do.
+    await asyncio.shield(start_warmup())
+
+
+def register_gauges():
+    metrics.gauge('generations_active', 'Messages holding a generation slot.',
+                  lambda: admission_middleware.controller.active)
+    metrics.gauge('generations_waiting', 'Messages waiting for a generation slot.',
+                  lambda: admission_middleware.controller.waiting)
+    metrics.gauge('generations_rejected_total', 'Messages rejected with a busy reply.',
+                  lambda: admission_middleware.controller.rejected, kind='counter')
+    metrics.gauge('rate_limited_total', 'Messages dropped by the per-user rate limit.',
+                  lambda: admission_middleware.rate_limiter.limited, kind='counter')
+    metrics.gauge('model_pool_queue_depth', 'Blocking model calls waiting for a worker thread.',
+                  lambda: model_pool.queue_depth)
+    metrics.gauge('live_sessions', 'User sessions held in memory.', lambda: len(sessions))
+    metrics.gauge('ollama_prewarms_total', 'Role prompt prewarms sent to Ollama on /run.',
+                  lambda: prewarmer.prewarms, kind='counter')
+    metrics.gauge('tier_active', 'Generations running on each model tier.',
+                  lambda: {name: tier.active for name, tier in model_router.tiers.items()}, label='tier')
+    metrics.gauge('tier_timeouts_total', 'Generations that missed the deadline of their model tier.',
+                  lambda: {name: tier.timeouts for name, tier in model_router.tiers.items()},
+                  kind='counter', label='tier')
+    metrics.gauge('tier_canned_answers_total', 'Answers replaced by a canned answer because no tier answered.',
+                  lambda: model_router.canned, kind='counter')
+    metrics.gauge('rule_evaluated_total', 'Messages checked against the rules, by rule set.',
+                  lambda: {name: stats['evaluated'] for name, stats in rule_registry.stats().items()},
+                  kind='counter', label='rules')
+    metrics.gauge('rule_hit_ratio', 'Share of the messages answered by a rule, by rule set.',
+                  lambda: {name: stats['hit_ratio'] for name, stats in rule_registry.stats().items()},
+                  label='rules')
+
+
+register_gauges()
+
+
+async def get_or_create_user(user):
+    # Checks if the user exists, if not, it will add the user to the session store.
+    session = await sessions.aget(user.id)
+    if session is None:
+        session = User(user_id=user.id,
+                       user_name=user.username if user.username else f"{user.first_name} {user.last_name}".strip())
+        session = await sessions.aadd(session)
+    return session
+
+
+async def pin_session(handler, event: Message, data):
+    # The session of a user with a handler in flight is not evicted, so the handler's changes are not lost.
+    if event.from_user is None:
+        return await handler(event, data)
+    with sessions.pinned(event.from_user.id):
+        return await handler(event, data)
+
+
+class StreamingReply(object):
+    """
+    Sends the first tokens of a streamed answer as soon as they arrive and keeps editing that message,
+    at most once every `interval` seconds, until the answer is complete. The time spent sending is recorded
+    as the telegram_send stage, with the `labels` of the answer.
+    """
+
+    def __init__(self, message: Message, interval=config.STREAM_EDIT_INTERVAL, enabled=config.STREAM_REPLIES):
+        self.message = message
+        self.interval = interval
+        self.enabled = enabled
+        self.reply = None
+        self.text = ''
+        self.sent_text = ''
+        self.last_edit = 0.0
+        self.send_time = 0.0
+        self.labels = {}
+
+    async def on_token(self, token):
+        if not self.enabled:
+            return
+        self.text += token
+        if not self.text.strip() or monotonic() - self.last_edit < self.interval:
+            return
+        await self.show(self.text)
+
+    async def reset(self):
+        # The tokens of an abandoned generation are replaced by the next ones on the next edit.
+        self.text = ''
+
+    async def show(self, text):
+        start = perf_counter()
+        if self.reply is None:
+            self.reply = await self.message.answer(text)
+        elif text != self.sent_text:
+            await self.reply.edit_text(text)
+        self.sent_text = text
+        self.last_edit = monotonic()
+        self.send_time += perf_counter() - start
+
+    async def finish(self, text):
+        await self.show(text)
+        stage_latency.observe(self.send_time, stage='telegram_send', **self.labels)
+        return self.reply
 
 
 def handle_routes(attack_router):
@@ -42,7 +170,7 @@ def handle_routes(attack_router):
     @attack_router.message(Command("start"))
     async def command_start(message: Message, scenes: ScenesManager):
         await scenes.close()
-        get_or_create_user(user=message.from_user)
+        await get_or_create_user(user=message.from_user)
         await message.answer(
             "Hi! It's Deceptify bot. To start a demo attack, first use the /type command.")
 
@@ -50,7 +178,7 @@ def handle_routes(attack_router):
     async def attack_type_command(message: Message, scenes: ScenesManager, state: FSMContext):
         await scenes.close()
         await state.update_data(attack_type=None)
-        get_or_create_user(user=message.from_user)
+        await get_or_create_user(user=message.from_user)
 
         await message.answer("Choose your attack (type the choice number or the name of the attack):\n"
                              "1.Bank\n"
@@ -65,7 +193,7 @@ def handle_routes(attack_router):
         Our project focuses on harnessing the power of AI to simulate social engineering attacks, using advanced technologies like generative AI and deepfakes. 
         The goal is to help organizations improve their awareness and preparedness against the ever-changing landscape of digital threats.
         """)
-        get_or_create_user(user=message.from_user)
+        await get_or_create_user(user=message.from_user)
 
     # @attack_router.message(Command('answer'))
     # async def answer_command(message: Message, scenes: ScenesManager, state: FSMContext):
@@ -77,7 +205,7 @@ def handle_routes(attack_router):
     @attack_router.message(Command('continue'))
     async def continue_command(message: Message, scenes: ScenesManager, state: FSMContext):
         await scenes.close()
-        user = get_or_create_user(user=message.from_user)
+        user = await get_or_create_user(user=message.from_user)
         if user.is_in_attack:
             await message.answer(user.current_answer)
             await scenes.enter(AttackScene, state, step=1)
@@ -85,14 +213,19 @@ def handle_routes(attack_router):
             await message.answer("No ongoing attack found. Please start a new attack using /start.")
 
     @attack_router.message(Command('transcript'))
-    async def transcript_command(message: Message, scenes: ScenesManager, state: FSMContext):
+    async def transcript_command(message: Message, scenes: ScenesManager, state: FSMContext, command: CommandObject):
         await scenes.close()
-        user = get_or_create_user(message.from_user)
+        user = await get_or_create_user(message.from_user)
 
         if user and not user.is_in_attack:
-            transcript = user.transcript
-            if transcript:
-                await message.answer(transcript)
+            # /transcript <page>, pages are read lazily from the compressed transcript of the last attack.
+            page = int(command.args) if command.args and command.args.strip().isdigit() else 1
+            await transcript_writer.flush()
+            text, has_next = await asyncio.to_thread(transcript_writer.read_page, user.user_id, page)
+            if text:
+                await message.answer(text)
+                if has_next:
+                    await message.answer(f"Send /transcript {page + 1} for the next page.")
             else:
                 await message.answer('No transcript is available for you.')
         else:
@@ -108,7 +241,7 @@ def handle_routes(attack_router):
     @attack_router.message(F.text.in_(['Bank', 'Delivery', 'Hospital']))
     async def set_attack_type_from_str(message: Message, state: FSMContext):
         await state.update_data(attack_type=message.text)
-        user = get_or_create_user(user=message.from_user)
+        user = await get_or_create_user(user=message.from_user)
         if not user.is_in_attack:
             await message.answer(f"Attack type '{message.text}' chosen. You can now run the attack with /run.")
         else:
@@ -123,7 +256,7 @@ def handle_routes(attack_router):
 
     @attack_router.message(F.text.in_(['1', '2', '3']))
     async def set_attack_type_from_number(message: Message, state: FSMContext):
-        user = get_or_create_user(user=message.from_user)
+        user = await get_or_create_user(user=message.from_user)
         if not user.is_in_attack:
             attack_type = None
             if message.text == "1":
@@ -146,17 +279,16 @@ def handle_routes(attack_router):
                     f"Your message can not be processed on the last time, It seems to be a problem on the server.\n"
                     f"I am sorry but I restarted your session. Run /start to start a new attack.")
 
-        @attack_router.message.register(GeneralConversationScene.as_handler())
-        async def start_general_conversation(message: Message, scenes: ScenesManager):
-            await message.answer("Let's talk!")
-            await scenes.enter(GeneralConversationScene)
-
 
 def create_dispatcher(attack_router):
     # Event isolation is needed to correctly handle fast user responses
     dispatcher = Dispatcher(
+        storage=create_fsm_storage(),
         events_isolation=SimpleEventIsolation(),
     )
+    # Rate limits and the global generation cap apply to every message, scenes included.
+    dispatcher.message.outer_middleware(admission_middleware)
+    dispatcher.message.outer_middleware(pin_session)
     dispatcher.include_router(attack_router)
 
     # To use scenes, you should create a SceneRegistry and register your scenes there
@@ -184,8 +316,12 @@ class AttackScene(Scene, state="run"):
                 await message.answer("Please choose an attack type first using /type.")
                 return
 
-            user = get_or_create_user(message.from_user)
-            user.start_new_attack(attack_type)
+            user = await get_or_create_user(message.from_user)
+            await wait_until_ready()
+            await model_pool.run(user.user_id, user.start_new_attack, attack_type)
+            if config.PREWARM_ENABLED:  # Loads the model and the role prompt while the client reads the intro.
+                prewarmer.prewarm(user.user_id, user.llm.get_prompt_prefix(), model_router.get_tier('attack').model)
+            await sessions.asave(user)
 
             await message.answer(user.llm.get_init_msg())
 
@@ -195,13 +331,18 @@ class AttackScene(Scene, state="run"):
         Method triggered when the user sends a message that is not a command or an answer.
         """
         try:
-            user = get_or_create_user(message.from_user)
+            user = await get_or_create_user(message.from_user)
 
             if user:
-                response = user.get_answer_from_llm(message.text.lower())
-                if 'bye' in response or 'bye' in message.text:
+                await wait_until_ready()
+                reply = StreamingReply(message)
+                response = await user.aget_answer_from_llm(message.text.lower(), on_token=reply.on_token,
+                                                           on_fallback=reply.reset)
+                reply.labels = user.llm.get_stage_labels()
+                if user.llm.is_conversation_done():
                     user.end_attack()
-                    await message.answer(response)
+                    await sessions.asave(user)
+                    await reply.finish(response)
 
                     return await self.wizard.exit()
 
@@ -212,10 +353,11 @@ class AttackScene(Scene, state="run"):
                 return await self.wizard.exit()
 
         except Exception as e:
-            print(f"Error: {e}")
+            logger.exception("Error while answering an attack message: %s", e)
             return await message.answer("Please generate a new attack using /type.")
 
-        return await message.answer(text=response)
+        await sessions.asave(user)
+        return await reply.finish(response)
 
 
 class GeneralConversationScene(Scene, state="answer"):
@@ -233,13 +375,24 @@ class GeneralConversationScene(Scene, state="answer"):
         Method triggered when the user sends a message that is not a command or an answer.
         """
         try:
-            response = llm.get_general_answer(message.text.lower())
-            if 'bye' in response or 'bye' in message.text:
-                await message.answer('See ya')
+            rules = rule_registry.get(GENERAL_RULES)
+            match = rules.match_terminal(message.text)
+            if match is not None and match.terminal:  # No need to wait for the models to say goodbye.
+                await message.answer(match.answer)
                 return await self.wizard.exit()
-            return await message.answer(text=response)
+
+            await wait_until_ready()
+            from llm import get_general_llm
+            reply = StreamingReply(message)
+            reply.labels = {'attack_type': 'general', 'faq': 'miss'}
+            response = await get_general_llm().aget_general_answer(message.text.lower(), on_token=reply.on_token,
+                                                                   on_fallback=reply.reset)
+            if rules.is_terminal(response):
+                await message.answer(rules.terminal_answer)
+                return await self.wizard.exit()
+            return await reply.finish(response)
         except Exception as e:
-            print(f"Error: {e}")
+            logger.exception("Error while answering a general message: %s", e)
             return await message.answer("Please explore the options you have /help.")
 
 
@@ -247,19 +400,61 @@ class ChatBot(object):
     def __init__(self):
         self.bot = None
         self.dispatcher = None
+        self.metrics_runner = None
 
         self.attack_router = Router(name=__name__)
         handle_routes(self.attack_router)
         self.shutdown_event = Event()
 
-    async def start(self):
+    def setup_dispatcher(self):
         # Add handler that initializes the scene
         self.attack_router.message.register(AttackScene.as_handler(), Command("run"))
         self.dispatcher = create_dispatcher(self.attack_router)
+        return self.dispatcher
 
+    def setup(self):
+        self.setup_dispatcher()
         self.bot = Bot(token=TOKEN)
+
+    async def warmup(self):
+        transcript_writer.start()
+        prewarmer.start()
+        if config.STARTUP_MODE == 'eager':
+            await wait_until_ready()
+        else:
+            start_warmup()  # Updates are handled now, /help and /start are answered while the models load.
+
+    async def start(self):
+        self.setup()
+        await self.warmup()
+        if config.METRICS_PORT:
+            self.metrics_runner = await start_metrics_server()
         await self.dispatcher.start_polling(self.bot)
 
+    def create_webhook_app(self):
+        # A webhook worker: updates forwarded by the front server (see webhook.py) are handled in the background.
+        self.setup()
+        app = web.Application()
+        SimpleRequestHandler(dispatcher=self.dispatcher, bot=self.bot, handle_in_background=True,
+                             secret_token=config.WEBHOOK_SECRET or None).register(app, path=config.WEBHOOK_PATH)
+        setup_application(app, self.dispatcher, bot=self.bot)
+        app.router.add_get('/metrics', handle_metrics)
+        app.on_startup.append(lambda app: self.warmup())
+        app.on_shutdown.append(lambda app: self.close())
+        return app
+
+    async def close(self):
+        from learner import stop_learner  # Imports langchain, kept out of the startup path.
+
+        if self.metrics_runner is not None:
+            await self.metrics_runner.cleanup()
+        stop_learner()
+        await transcript_writer.close()
+        await prewarmer.close()
+        sessions.close()
+        model_pool.shutdown(wait=False)
+        await ollama_client.close()
+
     def stop(self):
         self.shutdown_event.set()
         self.dispatcher.shutdown()
@@ -269,12 +464,23 @@ async def main():
     chatbot = ChatBot()
     try:
         await chatbot.start()
-    except KeyboardInterrupt:
+    finally:
+        # start_polling handles SIGINT/SIGTERM itself and returns, so the bot is closed on every way out.
         logging.info("Shutting down bot...")
-        learner.stop_active_learning()
-        chatbot.stop()
+        await chatbot.close()
+
+
+def run_webhook_worker(port):
+    # Entry point of a webhook worker process, serves on the loopback interface only.
+    logging.basicConfig(level=config.LOG_LEVEL)
+    web.run_app(ChatBot().create_webhook_app(), host='127.0.0.1', port=port)
 
 
 if __name__ == "__main__":
-    logging.basicConfig(level=logging.INFO)
-    asyncio.run(main())
+    logging.basicConfig(level=config.LOG_LEVEL)
+    if config.BOT_MODE == 'webhook':
+        from webhook import serve_webhook
+
+        serve_webhook(run_webhook_worker, TOKEN)
+    else:
+        asyncio.run(main())
@@ -0,0 +1,145 @@
+from os import cpu_count, getenv
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def get_bool(name, default=False):
+    value = getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def get_int(name, default):
+    value = getenv(name)
+    return int(value) if value else default
+
+
+def get_float(name, default):
+    value = getenv(name)
+    return float(value) if value else default
+
+
+def get_dict(name, default=''):
+    # "key=value,key=value" settings.
+    return dict(item.strip().split('=', 1) for item in getenv(name, default).split(',') if '=' in item)
+
+
+# Load FAISS indexes with IO_FLAG_MMAP so several bot worker processes share the same pages.
+FAISS_MMAP = get_bool('FAISS_MMAP')
+# How often (seconds) a knowledgebase checks its index meta and delta file for changes. 0 checks on every query.
+INDEX_CHECK_INTERVAL = get_float('INDEX_CHECK_INTERVAL', 1.0)
+# Batch size of the SentenceTransformer encode call when (re)building a knowledgebase index.
+EMBEDDING_BATCH_SIZE = get_int('EMBEDDING_BATCH_SIZE', 64)
+# Number of threads that run blocking model work (Ollama, SentenceTransformer) off the event loop.
+MODEL_WORKERS = get_int('MODEL_WORKERS', 4)
+# Ollama HTTP API used by the async client.
+OLLAMA_URL = getenv('OLLAMA_URL', 'http://localhost:11434')
+OLLAMA_POOL_SIZE = get_int('OLLAMA_POOL_SIZE', 16)
+OLLAMA_TIMEOUT = get_float('OLLAMA_TIMEOUT', 120.0)
+# Progressively edit the telegram reply while tokens stream in, at most once every STREAM_EDIT_INTERVAL seconds.
+STREAM_REPLIES = get_bool('STREAM_REPLIES', True)
+STREAM_EDIT_INTERVAL = get_float('STREAM_EDIT_INTERVAL', 0.7)
+# Prompt history: the last HISTORY_WINDOW_MESSAGES messages are kept verbatim, older ones are folded into a
+# rolling summary. HISTORY_TOKEN_BUDGET caps the (approximate) tokens of the history part of the prompt.
+HISTORY_WINDOW_MESSAGES = get_int('HISTORY_WINDOW_MESSAGES', 12)
+HISTORY_TOKEN_BUDGET = get_int('HISTORY_TOKEN_BUDGET', 1024)
+# Semantic cache of LLM answers per attack type: L2 distance threshold, entry TTL (seconds) and LRU capacity.
+SEMANTIC_CACHE_ENABLED = get_bool('SEMANTIC_CACHE_ENABLED', True)
+SEMANTIC_CACHE_THRESHOLD = get_float('SEMANTIC_CACHE_THRESHOLD', 0.35)
+SEMANTIC_CACHE_TTL = get_float('SEMANTIC_CACHE_TTL', 3600)
+SEMANTIC_CACHE_SIZE = get_int('SEMANTIC_CACHE_SIZE', 1024)
+# User sessions: SESSION_BACKEND is 'sqlite' (durable, SESSION_DB_PATH) or 'memory'. At most SESSION_CACHE_SIZE
+# live users are kept in memory, idle ones are evicted after SESSION_TTL seconds.
+SESSION_BACKEND = getenv('SESSION_BACKEND', 'sqlite')
+SESSION_DB_PATH = getenv('SESSION_DB_PATH', 'sessions.sqlite3')
+SESSION_CACHE_SIZE = get_int('SESSION_CACHE_SIZE', 256)
+SESSION_TTL = get_float('SESSION_TTL', 1800)
+# Embedding lookups arriving within EMBEDDING_BATCH_WINDOW seconds are encoded and searched together,
+# up to EMBEDDING_MAX_BATCH queries per batch.
+EMBEDDING_BATCH_WINDOW = get_float('EMBEDDING_BATCH_WINDOW', 0.005)
+EMBEDDING_MAX_BATCH = get_int('EMBEDDING_MAX_BATCH', 32)
+# Active learning: samples are appended to SAMPLES_PATH in batches of up to LEARNER_FLUSH_SIZE,
+# admins get a digest of the new samples every LEARNER_DIGEST_INTERVAL seconds.
+SAMPLES_PATH = getenv('SAMPLES_PATH', 'samples.jsonl')
+LEARNER_FLUSH_SIZE = get_int('LEARNER_FLUSH_SIZE', 32)
+LEARNER_DIGEST_INTERVAL = get_float('LEARNER_DIGEST_INTERVAL', 3600)
+# FAISS index type of the knowledgebases: flat, ivf, hnsw or ivfpq. INDEX_TYPES overrides it per
+# knowledgebase, e.g. "Bank=hnsw,Hospital=ivf". Approximate types fall back to flat on tiny knowledgebases.
+INDEX_TYPE = getenv('INDEX_TYPE', 'flat')
+INDEX_TYPES = dict(item.split('=', 1) for item in getenv('INDEX_TYPES', '').split(',') if '=' in item)
+INDEX_NLIST = get_int('INDEX_NLIST', 1024)
+INDEX_NPROBE = get_int('INDEX_NPROBE', 16)
+INDEX_HNSW_M = get_int('INDEX_HNSW_M', 32)
+INDEX_HNSW_EF_SEARCH = get_int('INDEX_HNSW_EF_SEARCH', 64)
+INDEX_PQ_M = get_int('INDEX_PQ_M', 48)
+# Similarity of the knowledgebase search: 'l2' (squared L2 distance) or 'cosine' (inner product over
+# L2-normalized vectors). Per-knowledgebase thresholds come from indexes/thresholds.json (calibrate_thresholds.py).
+INDEX_METRIC = getenv('INDEX_METRIC', 'l2')
+# Top-k knowledgebase pairs passed to the LLM as context, and the cap on generated tokens per answer.
+RAG_TOP_K = get_int('RAG_TOP_K', 3)
+LLM_NUM_PREDICT = get_int('LLM_NUM_PREDICT', 32)
+# Embedding backend: 'torch' (PyTorch), 'onnx' (ONNX Runtime) or 'onnx-int8' (int8 quantized ONNX, the
+# EMBEDDING_ONNX_INT8_FILE of the model repository). All of them run on CPU. The ONNX ones need the optional
+# optimum[onnxruntime] package.
+EMBEDDING_BACKEND = getenv('EMBEDDING_BACKEND', 'torch')
+EMBEDDING_ONNX_INT8_FILE = getenv('EMBEDDING_ONNX_INT8_FILE', 'onnx/model_quint8_avx2.onnx')
+# Ollama model of the attacks and general chat.
+OLLAMA_MODEL = getenv('OLLAMA_MODEL', 'llama3')
+# 'lazy' starts polling right away and loads the models in a background warmup task, 'eager' loads them first.
+STARTUP_MODE = getenv('STARTUP_MODE', 'lazy')
+# Serving: 'polling' (single process) or 'webhook'. In webhook mode a front aiohttp server on WEBHOOK_HOST:WEBHOOK_PORT
+# receives the updates at WEBHOOK_PATH and forwards each one to one of WEBHOOK_WORKERS worker processes (local ports
+# from WORKER_BASE_PORT), chosen by consistent hashing of the user id. WEBHOOK_URL is the public base url given to
+# telegram, WEBHOOK_SECRET is checked on every update.
+BOT_MODE = getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = getenv('WEBHOOK_URL', '')
+WEBHOOK_PATH = getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = getenv('WEBHOOK_SECRET', '')
+WEBHOOK_HOST = getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = get_int('WEBHOOK_PORT', 3333)
+WEBHOOK_WORKERS = get_int('WEBHOOK_WORKERS', cpu_count() or 1)
+WORKER_BASE_PORT = get_int('WORKER_BASE_PORT', 8081)
+# FSM and scene state: 'memory' (per process) or 'sqlite' (FSM_DB_PATH, shared by the workers and kept across restarts).
+FSM_STORAGE = getenv('FSM_STORAGE', 'memory')
+FSM_DB_PATH = getenv('FSM_DB_PATH', 'fsm.sqlite3')
+# Admission control: each user may send USER_RATE messages per second (bursts of USER_BURST). At most
+# MAX_GENERATIONS messages that need the models are handled at once, up to GENERATION_QUEUE_SIZE more wait for
+# GENERATION_QUEUE_TIMEOUT seconds, the others get a "busy" reply right away.
+USER_RATE = get_float('USER_RATE', 1.0)
+USER_BURST = get_int('USER_BURST', 5)
+MAX_GENERATIONS = get_int('MAX_GENERATIONS', 8)
+GENERATION_QUEUE_SIZE = get_int('GENERATION_QUEUE_SIZE', 32)
+GENERATION_QUEUE_TIMEOUT = get_float('GENERATION_QUEUE_TIMEOUT', 10.0)
+# Log level of the bot (DEBUG shows the per-query details), and the local Prometheus /metrics endpoint
+# (METRICS_PORT=0 disables it; webhook workers serve /metrics on their own port instead).
+LOG_LEVEL = getenv('LOG_LEVEL', 'INFO').upper()
+METRICS_HOST = getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = get_int('METRICS_PORT', 9100)
+# Transcripts: one append-only log per user under TRANSCRIPT_DIR, written every TRANSCRIPT_FLUSH_INTERVAL seconds
+# and gzip-archived when the attack ends. /transcript sends pages of at most TRANSCRIPT_PAGE_CHARS characters.
+TRANSCRIPT_DIR = getenv('TRANSCRIPT_DIR', 'transcripts')
+TRANSCRIPT_FLUSH_INTERVAL = get_float('TRANSCRIPT_FLUSH_INTERVAL', 1.0)
+TRANSCRIPT_PAGE_CHARS = get_int('TRANSCRIPT_PAGE_CHARS', 3500)
+# Ollama keeps the model loaded for OLLAMA_KEEP_ALIVE after each request (Ollama duration, e.g. "30m", -1 forever).
+# When no request was sent for OLLAMA_KEEPALIVE_INTERVAL seconds the model is loaded again (0 disables it), and
+# with PREWARM_ENABLED /run primes the role prompt of the attack before the first client message.
+OLLAMA_KEEP_ALIVE = getenv('OLLAMA_KEEP_ALIVE', '30m')
+OLLAMA_KEEPALIVE_INTERVAL = get_float('OLLAMA_KEEPALIVE_INTERVAL', 600)
+PREWARM_ENABLED = get_bool('PREWARM_ENABLED', True)
+
+# Model tiers: MODEL_TIERS maps a tier to an Ollama model, e.g. "small=llama3.2:1b,large=llama3". MODEL_ROUTES
+# sends each request class (general, attack, summary, knowledgebase) to a tier, unrouted classes use
+# DEFAULT_MODEL_TIER. Per tier: TIER_CONCURRENCY concurrent generations, TIER_DEADLINES seconds per attempt
+# (waiting for a slot included, OLLAMA_TIMEOUT by default, as before the tiers), and TIER_FALLBACKS, the tier
+# tried when the deadline passes or Ollama fails.
+DEFAULT_MODEL_TIER = getenv('DEFAULT_MODEL_TIER', 'large')
+MODEL_TIERS = get_dict('MODEL_TIERS') or {DEFAULT_MODEL_TIER: OLLAMA_MODEL}
+MODEL_ROUTES = get_dict('MODEL_ROUTES')
+TIER_CONCURRENCY = {tier: int(value) for tier, value in get_dict('TIER_CONCURRENCY').items()}
+TIER_DEADLINES = {tier: float(value) for tier, value in get_dict('TIER_DEADLINES').items()}
+TIER_FALLBACKS = get_dict('TIER_FALLBACKS')
+TIER_DEFAULT_CONCURRENCY = get_int('TIER_DEFAULT_CONCURRENCY', 8)
+TIER_DEFAULT_DEADLINE = get_float('TIER_DEFAULT_DEADLINE', OLLAMA_TIMEOUT)
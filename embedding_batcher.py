@@ -0,0 +1,101 @@
+import asyncio
+from time import monotonic, perf_counter
+
+import config
+from embeddings import encode_queries
+from workers import model_pool
+
+
+class EmbeddingBatcher(object):
+    """
+    Coalesces the knowledgebase lookups of concurrent users. Queries arriving within `window` seconds
+    (up to `max_batch`) are encoded in one SentenceTransformer call and searched with one FAISS search
+    per knowledgebase, then every waiting coroutine gets its own (vector, indices, distances).
+    A `timings` dict passed to search() receives the batch wait, encode and search seconds of the query.
+    """
+
+    def __init__(self, window=config.EMBEDDING_BATCH_WINDOW, max_batch=config.EMBEDDING_MAX_BATCH,
+                 k=config.RAG_TOP_K):
+        self.window = window
+        self.max_batch = max_batch
+        self.k = k
+        self.queue = []  # (knowledgebase, text, future, enqueued_at, timings)
+        self.flush_handle = None
+
+        self.batches = 0
+        self.queries = 0
+        self.total_wait = 0.0  # Seconds spent by queries waiting for their batch to start.
+        self.total_batch_time = 0.0  # Seconds spent encoding and searching.
+
+    async def search(self, kb, text, timings=None):
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.queue.append((kb, text, future, monotonic(), timings))
+        if len(self.queue) >= self.max_batch:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.queue = self.queue, []
+        if batch:
+            asyncio.get_running_loop().create_task(self.run_batch(batch))
+
+    async def run_batch(self, batch):
+        started = monotonic()
+        try:
+            results, batch_timings = await model_pool.run(id(batch), self.compute,
+                                                          [(kb, text) for kb, text, _, _, _ in batch])
+        except Exception as e:
+            for _, _, future, _, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        self.batches += 1
+        self.queries += len(batch)
+        self.total_batch_time += monotonic() - started
+        for row, ((_, _, future, enqueued_at, timings), result) in enumerate(zip(batch, results)):
+            self.total_wait += started - enqueued_at
+            if timings is not None:
+                timings.update(batch_wait=started - enqueued_at, encode=batch_timings['encode'],
+                               search=batch_timings['search'][row])
+            if not future.done():
+                future.set_result(result)
+
+    def compute(self, queries):
+        # Runs on a model worker thread.
+        start = perf_counter()
+        vectors = encode_queries([text for _, text in queries])
+        timings = {'encode': perf_counter() - start, 'search': [0.0] * len(queries)}
+        rows_by_kb = {}
+        for row, (kb, _) in enumerate(queries):
+            rows_by_kb.setdefault(id(kb), (kb, []))[1].append(row)
+
+        results = [None] * len(queries)
+        for kb, rows in rows_by_kb.values():
+            start = perf_counter()
+            indices, distances = kb.search(vectors[rows], self.k)
+            elapsed = perf_counter() - start
+            for i, row in enumerate(rows):
+                results[row] = (vectors[row:row + 1], indices[i:i + 1], distances[i:i + 1])
+                timings['search'][row] = elapsed
+        return results, timings
+
+    def stats(self):
+        return {
+            'batches': self.batches,
+            'queries': self.queries,
+            'pending': len(self.queue),
+            'avg_batch_size': self.queries / self.batches if self.batches else 0.0,
+            'avg_wait_ms': 1000 * self.total_wait / self.queries if self.queries else 0.0,
+            'avg_batch_ms': 1000 * self.total_batch_time / self.batches if self.batches else 0.0,
+            'queries_per_second': self.queries / self.total_batch_time if self.total_batch_time else 0.0,
+        }
+
+
+embedding_batcher = EmbeddingBatcher()
@@ -1,17 +1,491 @@
+import glob
+import hashlib
 import json
+import logging
 import os
+from threading import Lock
+from time import monotonic, perf_counter
+from types import MappingProxyType
 
 import faiss
 import numpy as np
-import pandas as pd
-from sentence_transformers import SentenceTransformer
+
+import config
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_DIM = 384
+
+# Default thresholds per metric. For unit vectors a squared L2 distance d is a cosine similarity of 1 - d / 2.
+DEFAULT_THRESHOLDS = {
+    'l2': {'answer': 0.7, 'active_learning': 1.39999, 'context': 1.1},
+    'cosine': {'answer': 0.65, 'active_learning': 0.3, 'context': 0.45},
+}
+
+EMBEDDING_BACKENDS = ('torch', 'onnx', 'onnx-int8')
+
+_embedding_model = None
+_embedding_model_lock = Lock()
+
+
+def load_embedding_model(backend=None):
+    from sentence_transformers import SentenceTransformer  # Heavy (torch), imported when the model is loaded.
+
+    backend = backend or config.EMBEDDING_BACKEND
+    if backend in ('onnx', 'onnx-int8'):
+        try:
+            import optimum.onnxruntime  # noqa: F401
+        except ImportError:
+            raise ImportError(f"The {backend} embedding backend needs optimum with ONNX Runtime, "
+                              "install it with: pip install 'optimum[onnxruntime]'") from None
+    if backend == 'torch':
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu')
+    if backend == 'onnx':
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu', backend='onnx')
+    if backend == 'onnx-int8':
+        return SentenceTransformer(EMBEDDING_MODEL_NAME, device='cpu', backend='onnx',
+                                   model_kwargs={'file_name': config.EMBEDDING_ONNX_INT8_FILE})
+    raise ValueError(f"Unknown embedding backend {backend}, expected one of {EMBEDDING_BACKENDS}.")
+
+
+def get_embedding_model():
+    # One SentenceTransformer per process, loaded on first use and shared by every attack session.
+    global _embedding_model
+    if _embedding_model is None:
+        with _embedding_model_lock:
+            if _embedding_model is None:
+                _embedding_model = load_embedding_model()
+    return _embedding_model
+
+
+def warmup_embedding_model():
+    # The first encode calls pay for lazy initialization (kernels, tokenizer caches), do them at startup.
+    model = get_embedding_model()
+    model.encode('hello')
+    model.encode(['warm up the batch path', 'of the embedding model'], batch_size=2)
+    return model
+
+
+def get_knowledgebase_file_path(knowledgebase):
+    dire = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', knowledgebase.lower())
+    return os.path.join(dire, f'{knowledgebase}-knowledge.csv')
+
+
+def get_index_file_path(knowledgebase):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes', f'{knowledgebase}-faiss.index')
+
+
+def get_embeddings_file_path(knowledgebase):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes', f'{knowledgebase}-embeddings.npy')
+
+
+def get_thresholds_file_path():
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes', 'thresholds.json')
+
+
+def load_thresholds(knowledgebase, metric=None):
+    # Calibrated thresholds of the knowledgebase for the metric, or the defaults of the metric.
+    metric = metric or config.INDEX_METRIC
+    thresholds = dict(DEFAULT_THRESHOLDS[metric])
+    path = get_thresholds_file_path()
+    if os.path.exists(path):
+        with open(path, 'r') as f:
+            thresholds.update(json.load(f).get(knowledgebase, {}).get(metric, {}))
+    return thresholds
+
+
+def is_cosine(metric=None):
+    return (metric or config.INDEX_METRIC) == 'cosine'
+
+
+def is_close(score, threshold, metric=None):
+    # Distances match below the threshold, cosine similarities above it.
+    return score > threshold if is_cosine(metric) else score < threshold
+
+
+def prepare_vectors(matrix, metric=None):
+    # Vectors are stored raw; in cosine mode they are L2-normalized before they reach an inner product index.
+    matrix = np.ascontiguousarray(matrix, dtype="float32")
+    if is_cosine(metric):
+        matrix = matrix.copy()
+        faiss.normalize_L2(matrix)
+    return matrix
+
+
+def get_delta_file_path(knowledgebase):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes', f'{knowledgebase}-delta.jsonl')
+
+
+def get_index_meta_file_path(knowledgebase):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes', f'{knowledgebase}-faiss.json')
+
+
+def list_knowledgebases():
+    prompts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+    paths = glob.glob(os.path.join(prompts_dir, '*', '*-knowledge.csv'))
+    return sorted(os.path.basename(path)[:-len('-knowledge.csv')] for path in paths)
+
+
+def get_content_hash(file_path):
+    # The index is keyed by the csv content and the encoder (model and backend), so touching the file does
+    # not trigger a rebuild.
+    digest = hashlib.sha256(f'{EMBEDDING_MODEL_NAME}:{config.EMBEDDING_BACKEND}'.encode())
+    with open(file_path, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+def read_faq(knowledgebase_file_path):
+    import pandas as pd
+
+    with open(knowledgebase_file_path, 'r') as f:
+        header = f.readline()
+    sep = ';' if ';' in header else ','  # Zoom-knowledge.csv is comma separated.
+    df = pd.read_csv(knowledgebase_file_path, sep=sep, skipinitialspace=True).dropna()
+    faq = []
+    sentences_map = {}
+    for x, y in df.values:
+        faq.append(x)
+        sentences_map[x] = y
+    return faq, sentences_map
+
+
+def read_index(index_path, mmap=False):
+    if mmap:
+        return faiss.read_index(index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    return faiss.read_index(index_path)
+
+
+def merge_neighbors(distances, indices, other_distances, other_indices, k, descending=False):
+    # Merges two (distances, indices) search results into the k closest per query.
+    distances = np.concatenate([distances, other_distances], axis=1)
+    indices = np.concatenate([indices, other_indices], axis=1)
+    order = np.argsort(-distances if descending else distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, order, axis=1), np.take_along_axis(indices, order, axis=1)
+
+
+class Knowledgebase(object):
+    """
+    FAISS index and answer table of a single knowledgebase (Bank, Delivery, ...), shared by all the attack
+    sessions of the same type. The base index is built from the csv; approved samples ingested later live
+    in an append-only delta file (see ingest_pairs), loaded into a small ID-mapped index on top.
+    The indexes and the answer table are never modified in place: they are published together as one
+    snapshot, so a concurrent search always sees a consistent set. A base index rebuilt on disk is
+    reloaded with its csv as one unit, keyed by the content hash in its -faiss.json meta.
+    """
+
+    def __init__(self, name, file_path, index_path):
+        self.name = name
+        self.file_path = file_path
+        self.index_path = index_path
+        self.meta_path = get_index_meta_file_path(name)
+        self.delta_path = get_delta_file_path(name)
+        self.metric = config.INDEX_METRIC
+
+        self.state = None  # (index, delta_index, faq, sentences_map)
+        self.base_rows = 0
+        self.meta_version = None
+        self.delta_offset = 0  # Bytes of the delta file already loaded.
+        self.last_check = None
+        self._lock = Lock()
+        with self._lock:
+            if not self.load():
+                raise RuntimeError(f"The index of {name} was not built from {file_path}, run build_indexes.py.")
+        self.last_check = monotonic()
+
+    @property
+    def index(self):
+        return self.state[0]
+
+    @property
+    def delta_index(self):
+        return self.state[1]
+
+    @property
+    def faq(self):
+        return self.state[2]
+
+    @property
+    def sentences_map(self):
+        return self.state[3]
+
+    def get_meta_version(self):
+        try:
+            stat = os.stat(self.meta_path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self):
+        """
+        Loads the csv and the base index built from it, with the delta rows on top, and swaps them in.
+        Keeps the loaded snapshot and returns False when the index on disk was not built from this csv
+        content (a rebuild still in progress, or a csv edited without rebuilding).
+        """
+        self.meta_version = self.get_meta_version()
+        content_hash = get_content_hash(self.file_path)
+        if read_index_meta(self.name).get('content_hash') != content_hash:
+            logger.warning("The index of %s does not match its csv, keeping the loaded one.", self.name)
+            return False
+        index = read_index(self.index_path, mmap=config.FAISS_MMAP)
+        if read_index_meta(self.name).get('content_hash') != content_hash:
+            return False  # Rebuilt while it was being read, picked up on the next check.
+
+        faq, sentences_map = read_faq(self.file_path)
+        flat = faiss.IndexFlatIP(EMBEDDING_DIM) if is_cosine(self.metric) else faiss.IndexFlatL2(EMBEDDING_DIM)
+        state = (index, faiss.IndexIDMap2(flat), faq, MappingProxyType(sentences_map))
+        state, offset, _ = self.read_delta(state, 0)
+        self.state, self.delta_offset, self.base_rows = state, offset, len(faq)
+        logger.info("Loaded the %s knowledgebase: %d rows, %d delta rows.", self.name, len(faq),
+                    state[1].ntotal)
+        return True
+
+    def read_delta(self, state, offset):
+        """
+        Returns a copy of `state` with the rows of the delta file after `offset` appended, the new offset
+        and the number of rows added. The delta rows get the ids that follow the answer table of `state`.
+        """
+        if not os.path.exists(self.delta_path) or os.path.getsize(self.delta_path) <= offset:
+            return state, offset, 0
+        with open(self.delta_path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+        complete = data[:data.rfind(b'\n') + 1]  # A line still being written is picked up next time.
+        records = [json.loads(line) for line in complete.splitlines() if line.strip()]
+        offset += len(complete)
+        if not records:
+            return state, offset, 0
+
+        index, delta_index, faq, sentences_map = state
+        vectors = prepare_vectors(np.asarray([record['vector'] for record in records]), self.metric)
+        ids = np.arange(len(faq), len(faq) + len(records), dtype="int64")
+        delta_index = faiss.clone_index(delta_index)
+        delta_index.add_with_ids(vectors, ids)
+        faq = faq + [record['question'] for record in records]
+        sentences_map = dict(sentences_map)
+        sentences_map.update((record['question'], record['answer']) for record in records)
+        return (index, delta_index, faq, MappingProxyType(sentences_map)), offset, len(records)
+
+    def refresh(self, force=False):
+        """
+        Picks up the changes on disk: a rebuilt base index reloads the whole knowledgebase, otherwise only
+        the rows appended to the delta file since the last call are loaded, O(new rows).
+        Checked at most every INDEX_CHECK_INTERVAL seconds unless forced. Returns the number of delta rows
+        added.
+        """
+        now = monotonic()
+        if not force and self.last_check is not None and now - self.last_check < config.INDEX_CHECK_INTERVAL:
+            return 0
+        self.last_check = now
+
+        with self._lock:
+            if self.get_meta_version() != self.meta_version and self.load():
+                return 0
+            self.state, self.delta_offset, added = self.read_delta(self.state, self.delta_offset)
+            return added
+
+    def search(self, query_vector, k=3):
+        self.refresh()
+        index, delta_index, _, _ = self.state  # Searched as loaded now, a concurrent refresh swaps in new ones.
+        distances, indices = index.search(query_vector, k)
+        if delta_index.ntotal:
+            delta_distances, delta_indices = delta_index.search(query_vector, min(k, delta_index.ntotal))
+            distances, indices = merge_neighbors(distances, indices, delta_distances, delta_indices, k,
+                                                 descending=is_cosine(self.metric))
+        return indices, distances
+
+    def get_answer(self, faq_index):
+        _, _, faq, sentences_map = self.state
+        return sentences_map[faq[faq_index]]
+
+
+class KnowledgebaseRegistry(object):
+    """
+    Process-wide registry that holds one Knowledgebase per attack type.
+    """
+
+    def __init__(self):
+        self._knowledgebases = {}
+        self._lock = Lock()
+
+    def get(self, knowledgebase):
+        kb = self._knowledgebases.get(knowledgebase)
+        if kb is None:
+            with self._lock:
+                kb = self._knowledgebases.get(knowledgebase)
+                if kb is None:
+                    kb = self.build(knowledgebase)
+                    self._knowledgebases[knowledgebase] = kb
+        return kb
+
+    def build(self, knowledgebase):
+        file_path = get_knowledgebase_file_path(knowledgebase)
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"The knowledge base file {file_path} does not exist.")
+
+        build_index(knowledgebase)
+        return Knowledgebase(knowledgebase, file_path, get_index_file_path(knowledgebase))
+
+    def loaded(self):
+        return list(self._knowledgebases.keys())
+
+
+knowledgebase_registry = KnowledgebaseRegistry()
+
+
+def encode_faq(faq, batch_size=config.EMBEDDING_BATCH_SIZE):
+    # One batched encode call into a contiguous (rows, dim) float32 matrix.
+    matrix = get_embedding_model().encode(list(faq), batch_size=batch_size, convert_to_numpy=True)
+    return np.ascontiguousarray(matrix, dtype="float32").reshape(-1, EMBEDDING_DIM)
+
+
+def ingest_pairs(knowledgebase, pairs, batch_size=config.EMBEDDING_BATCH_SIZE):
+    """
+    Appends approved (question, answer) pairs to the knowledgebase without rebuilding it: only the new
+    questions are encoded, and their rows are appended to indexes/{knowledgebase}-delta.jsonl in a single
+    write. Running bot processes pick them up on their next search. Returns the number of rows added.
+    """
+    kb = knowledgebase_registry.get(knowledgebase)
+    kb.refresh(force=True)
+
+    new_pairs = {}
+    for question, answer in pairs:
+        question = question.strip().lower()
+        if question and question not in kb.sentences_map:
+            new_pairs[question] = answer.strip()
+    if not new_pairs:
+        return 0
+
+    matrix = encode_faq(list(new_pairs.keys()), batch_size=batch_size)
+    lines = ''.join(json.dumps({'question': question, 'answer': answer, 'vector': vector.tolist()}) + '\n'
+                    for (question, answer), vector in zip(new_pairs.items(), matrix))
+
+    os.makedirs(os.path.dirname(kb.delta_path), exist_ok=True)
+    with open(kb.delta_path, 'a') as f:
+        f.write(lines)
+        f.flush()
+        os.fsync(f.fileno())
+
+    kb.refresh(force=True)
+    return len(new_pairs)
+
+
+def encode_queries(texts):
+    # Encodes a batch of user prompts in one call, one float32 row per prompt, ready for the index metric.
+    matrix = get_embedding_model().encode(list(texts), batch_size=len(texts), convert_to_numpy=True)
+    return prepare_vectors(np.asarray(matrix).reshape(-1, EMBEDDING_DIM))
+
+
+def read_index_meta(knowledgebase):
+    meta_path = get_index_meta_file_path(knowledgebase)
+    if not os.path.exists(meta_path):
+        return {}
+    with open(meta_path, 'r') as f:
+        return json.load(f)
+
+
+def write_atomic(path, write):
+    # Write to a temporary file and swap it in, so readers never see a half written file.
+    tmp_path = f'{path}.tmp'
+    write(tmp_path)
+    os.replace(tmp_path, path)
+
+
+INDEX_TYPES = ('flat', 'ivf', 'hnsw', 'ivfpq')
+
+
+def get_index_type(knowledgebase):
+    return config.INDEX_TYPES.get(knowledgebase, config.INDEX_TYPE)
+
+
+def create_index(index_type, matrix, dim=EMBEDDING_DIM, metric=None):
+    """
+    Creates, trains (for the IVF types) and fills an index of `index_type` over the rows of `matrix`.
+    Knowledgebases too small to train an approximate index get an exact flat one.
+    In cosine mode the index is an inner product one over the L2-normalized rows.
+    """
+    cosine = is_cosine(metric)
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if cosine else faiss.METRIC_L2
+    matrix = prepare_vectors(matrix, metric)
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type {index_type}, expected one of {INDEX_TYPES}.")
+    rows = matrix.shape[0]
+    nlist = max(1, min(config.INDEX_NLIST, int(4 * np.sqrt(rows))))
+
+    # HNSW visits at least efSearch rows per query, at or below that a flat scan is exact for the same work.
+    if index_type == 'hnsw' and rows > config.INDEX_HNSW_EF_SEARCH:
+        index = faiss.IndexHNSWFlat(dim, config.INDEX_HNSW_M, faiss_metric)
+        index.hnsw.efSearch = config.INDEX_HNSW_EF_SEARCH
+    elif index_type == 'ivf' and rows >= 39 * nlist:
+        index = faiss.IndexIVFFlat(faiss.IndexFlat(dim, faiss_metric), dim, nlist, faiss_metric)
+    elif index_type == 'ivfpq' and rows >= 256 * 39 and dim % config.INDEX_PQ_M == 0:
+        index = faiss.IndexIVFPQ(faiss.IndexFlat(dim, faiss_metric), dim, nlist, config.INDEX_PQ_M, 8, faiss_metric)
+    else:
+        index = faiss.IndexFlatIP(dim) if cosine else faiss.IndexFlatL2(dim)
+
+    if not index.is_trained:
+        index.train(matrix)
+        index.nprobe = min(config.INDEX_NPROBE, nlist)
+    index.add(matrix)
+    return index
+
+
+def build_index(knowledgebase, faq=None, batch_size=config.EMBEDDING_BATCH_SIZE, force=False):
+    """
+    Builds indexes/{knowledgebase}-faiss.index from its csv, unless the csv content hash and the configured
+    index type did not change. The encoded matrix is cached in indexes/{knowledgebase}-embeddings.npy under
+    the same hash, so changing the index type only retrains the index.
+    Returns True if the index was (re)written.
+    """
+    file_path = get_knowledgebase_file_path(knowledgebase)
+    index_path = get_index_file_path(knowledgebase)
+    embeddings_path = get_embeddings_file_path(knowledgebase)
+    content_hash = get_content_hash(file_path)
+
+    index_type = get_index_type(knowledgebase)
+    metric = config.INDEX_METRIC
+
+    meta = read_index_meta(knowledgebase)
+    if not force and meta.get('content_hash') == content_hash and meta.get('index_type', 'flat') == index_type \
+            and meta.get('metric', 'l2') == metric and os.path.exists(index_path):
+        return False
+
+    if faq is None:
+        faq, _ = read_faq(file_path)
+
+    matrix = None
+    if not force and meta.get('content_hash') == content_hash and os.path.exists(embeddings_path):
+        matrix = np.load(embeddings_path)
+    if matrix is None or matrix.shape[0] != len(faq):
+        matrix = encode_faq(faq, batch_size=batch_size)
+
+    index = create_index(index_type, matrix, metric=metric)
+
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    meta = {'content_hash': content_hash, 'model': EMBEDDING_MODEL_NAME, 'backend': config.EMBEDDING_BACKEND,
+            'rows': len(faq), 'index_type': index_type, 'metric': metric}
+
+    def save_matrix(path):
+        with open(path, 'wb') as f:
+            np.save(f, matrix)
+
+    def save_meta(path):
+        with open(path, 'w') as f:
+            json.dump(meta, f)
+
+    write_atomic(embeddings_path, save_matrix)
+    write_atomic(index_path, lambda path: faiss.write_index(index, path))
+    write_atomic(get_index_meta_file_path(knowledgebase), save_meta)
+    return True
 
 
 class embeddings(object):
-    def __init__(self, knowledgebase=None):
-        self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
-        self.index = faiss.IndexFlatL2(384)
+    """
+    Lightweight per-attack handle to the shared encoder and knowledgebase registry.
+    """
 
+    def __init__(self, knowledgebase=None):
         self.knowledgebase = knowledgebase if knowledgebase is not None else 'clone'  # Clone for no-purpose attack
 
         self.json_filename_for_sentences_map = f'{self.knowledgebase}.json'
@@ -20,18 +494,39 @@ class embeddings(object):
         # Fetch the correct csv file according the knowledgebase param.
         self.knowledgebase_file_path = None
         self.faq = None
+        self.kb = None
+
+        self.last_query_vector = None  # Embedding of the last prompt, reused by the semantic answer cache.
+        self.last_context = []  # FAQ pairs close enough to the last prompt to ground the LLM answer.
+        self.last_timings = {}  # Encode and search seconds of the last get_answer_from_embedding.
 
         self.stop = False
-        self.active_learner_threshold = 1.39999  # Decide which threshold is valid to apply active learning.
+        thresholds = load_thresholds(self.knowledgebase)
+        self.threshold = thresholds['answer']  # Decide which score is close enough to answer from the FAQ.
+        self.context_threshold = thresholds['context']  # Decide which FAQ pairs are relevant as LLM context.
+        self.active_learner_threshold = thresholds['active_learning']  # Decide which threshold is valid to apply active learning.
+
+    @property
+    def embedding_model(self):
+        return get_embedding_model()
+
+    def get_context_pairs(self, indices, distances, k=config.RAG_TOP_K):
+        # Top-k (question, answer) pairs that pass the context score filter, closest first.
+        pairs = []
+        for faq_index, score in zip(indices[0][:k], distances[0][:k]):
+            if faq_index < 0 or not is_close(score, self.context_threshold):
+                continue
+            try:
+                pairs.append((self.kb.faq[faq_index], self.kb.get_answer(faq_index)))
+            except (IndexError, KeyError):
+                continue
+        return pairs
 
-    def get_nearest_neighbors(self, vector, k=3):
-        index = faiss.read_index(
-            os.path.join(os.path.dirname(os.path.abspath(__file__)), f'indexes/{self.knowledgebase}-faiss.index'))
+    def get_nearest_neighbors(self, vector, k=config.RAG_TOP_K):
         if isinstance(vector, tuple):
             vector = np.array(vector)
         query_vector = vector.astype("float32").reshape(1, -1)
-        distances, indices = index.search(query_vector, k)
-        return indices, distances
+        return self.kb.search(query_vector, k)
 
     def flush(self):
         self.sentences_map = {}
@@ -40,78 +535,73 @@ class embeddings(object):
         self.json_filename_for_sentences_map = None
         self.faq = None
         self.knowledgebase = None
-        self.index = faiss.IndexFlatL2(384)
+        self.kb = None
 
     def initialize_again(self, knowledgebase):
         self.knowledgebase = knowledgebase
         self.json_filename_for_sentences_map = f'{self.knowledgebase}.json'
         self.init_knowledgebase_path(knowledgebase)
+        self.kb = knowledgebase_registry.get(knowledgebase)
         self.faq = self.get_faq()
+        thresholds = load_thresholds(knowledgebase)
+        self.threshold = thresholds['answer']
+        self.context_threshold = thresholds['context']
+        self.active_learner_threshold = thresholds['active_learning']
 
     def init_knowledgebase_path(self, knowledgebase):
-        dire = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts', knowledgebase.lower())
-
-        if knowledgebase is None:
-            knowledgebase = 'knowledgebase_custom.csv'
-            self.knowledgebase_file_path = os.path.join(dire, knowledgebase)
-        else:
-            self.knowledgebase_file_path = os.path.join(dire, f'{knowledgebase}-knowledge.csv')
-
-        if not os.path.exists(dire):
-            os.makedirs(dire)
+        self.knowledgebase_file_path = get_knowledgebase_file_path(knowledgebase)
 
         if not os.path.exists(self.knowledgebase_file_path):
             raise FileNotFoundError(f"The knowledge base file {self.knowledgebase_file_path} does not exist.")
 
     def save_sentences_map(self):
-        sentences_map_json = json.dumps(self.sentences_map)
+        sentences_map_json = json.dumps(dict(self.sentences_map))
         with open(self.json_filename_for_sentences_map, 'w') as f:
             f.write(sentences_map_json)
 
     def generate_faq_embedding(self):
-        for qa in self.faq:  # Create the embedding representation for each row in the knowledgebase.
-            embedding = self.get_embedding(qa)
-            self.index.add(embedding)
-
-        indexes_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'indexes')
-        os.makedirs(indexes_dir, exist_ok=True)
-        index_path = os.path.join(indexes_dir, f'{self.knowledgebase.lower()}-faiss.index')
-        faiss.write_index(self.index, index_path)
+        # The index is built once per process by the registry, here we only make sure it is there.
+        self.kb = knowledgebase_registry.get(self.knowledgebase)
 
     def get_faq(self):
-        df = pd.read_csv(self.knowledgebase_file_path, sep=";").dropna()
-        faq = []
-        for x, y in df.values:
-            faq.append(x)
-            self.sentences_map[x] = y
-        return faq
+        self.sentences_map = self.kb.sentences_map
+        return self.kb.faq
 
     def get_embedding(self, _input):
-        embedding = self.embedding_model.encode(_input)
+        embedding = self.embedding_model.encode(_input, normalize_embeddings=is_cosine())
         # return np.array([embedding])  # Ensure it returns a 2D array
         return tuple(embedding)
 
-    def get_answer_from_embedding(self, _input, threshold=0.7):
-        print(_input)
+    def get_answer_from_embedding(self, _input, threshold=None):
+        logger.debug("Knowledgebase query: %s", _input)
+        start = perf_counter()
         prompt_embedding = self.get_embedding(_input.lower())  # Get the embedding representation for the prompt
+        encoded = perf_counter()
 
         if isinstance(prompt_embedding, tuple):
             prompt_embedding = np.array(prompt_embedding).reshape(1, -1).astype("float32")
+        self.last_query_vector = prompt_embedding
 
         indices, distances = self.get_nearest_neighbors(prompt_embedding)
+        self.last_timings = {'encode': encoded - start, 'search': perf_counter() - encoded}
+        return self.get_answer_from_neighbors(prompt_embedding, indices, distances, threshold=threshold)
 
-        closest_distance = distances[0][0]
-        print(closest_distance)
+    def get_answer_from_neighbors(self, prompt_embedding, indices, distances, threshold=None):
+        # Second half of get_answer_from_embedding, for lookups already encoded and searched in a batch.
+        # Scores are L2 distances or cosine similarities depending on the index metric.
+        self.last_query_vector = prompt_embedding
+        self.last_context = self.get_context_pairs(indices, distances)
+        closest_score = distances[0][0]
+        logger.debug("Closest knowledgebase score: %s", closest_score)
         faq_index = indices[0][0]  # Taking the closest FAQ index
 
-        if closest_distance < threshold:
+        if is_close(closest_score, self.threshold if threshold is None else threshold):
             try:
-                answer = self.sentences_map[self.faq[faq_index]]
-            except IndexError as e:
-                print(f"IndexError: {e}")
-                print(f"Cannot find the value for the given key: {self.faq[faq_index]}")
+                answer = self.kb.get_answer(faq_index)
+            except (IndexError, KeyError) as e:
+                logger.warning("Cannot find the answer for the FAQ index %s: %s", faq_index, e)
                 answer = "Can you repeat it?"
         else:
             answer = None
 
-        return answer, closest_distance > self.active_learner_threshold
+        return answer, not is_close(closest_score, self.active_learner_threshold)
@@ -0,0 +1,69 @@
+import asyncio
+import json
+import sqlite3
+from threading import Lock
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import config
+
+
+def format_key(key: StorageKey):
+    parts = (key.bot_id, key.chat_id, key.user_id, key.thread_id, getattr(key, 'business_connection_id', None),
+             key.destiny)
+    return ':'.join('' if part is None else str(part) for part in parts)
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    FSM and scene state in a local SQLite file, shared by the webhook worker processes (WAL) and kept across
+    restarts. Every call is a single-row lookup by primary key, run on a thread.
+    """
+
+    def __init__(self, path=config.FSM_DB_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute("CREATE TABLE IF NOT EXISTS fsm "
+                                "(key TEXT PRIMARY KEY, state TEXT, data TEXT NOT NULL DEFAULT '{}')")
+        self.connection.commit()
+        self._lock = Lock()
+
+    def fetch(self, key, column):
+        with self._lock:
+            row = self.connection.execute(f'SELECT {column} FROM fsm WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def store(self, key, column, value):
+        with self._lock:
+            self.connection.execute(f'INSERT INTO fsm (key, {column}) VALUES (?, ?) '
+                                    f'ON CONFLICT(key) DO UPDATE SET {column} = excluded.{column}', (key, value))
+            self.connection.commit()
+
+    async def set_state(self, key: StorageKey, state=None) -> None:
+        value = state.state if isinstance(state, State) else state
+        await asyncio.to_thread(self.store, format_key(key), 'state', value)
+
+    async def get_state(self, key: StorageKey):
+        return await asyncio.to_thread(self.fetch, format_key(key), 'state')
+
+    async def set_data(self, key: StorageKey, data) -> None:
+        await asyncio.to_thread(self.store, format_key(key), 'data', json.dumps(dict(data)))
+
+    async def get_data(self, key: StorageKey):
+        data = await asyncio.to_thread(self.fetch, format_key(key), 'data')
+        return json.loads(data) if data else {}
+
+    async def close(self) -> None:
+        with self._lock:
+            self.connection.close()
+
+
+def create_fsm_storage(storage=config.FSM_STORAGE):
+    if storage == 'sqlite':
+        return SQLiteStorage()
+    if storage == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown FSM storage: {storage}")
@@ -0,0 +1,60 @@
+"""
+Adds approved question/answer pairs to the knowledgebases without a full rebuild.
+Only the new rows are encoded; running bot processes pick them up without a restart.
+
+The input is either a JSONL file in the samples store format (one {"question", "answer", "knowledgebase"}
+record per line, e.g. the approved lines of samples.jsonl) or a "Question";"Answer" csv like the
+*-knowledge.csv files, which needs --knowledgebase.
+
+    python ingest_samples.py approved.jsonl
+    python ingest_samples.py --knowledgebase Bank approved.csv
+"""
+import argparse
+import json
+import os
+from collections import defaultdict
+
+import config
+from embeddings import ingest_pairs, read_faq
+
+
+def get_knowledgebase_name(knowledgebase_file_path):
+    # Samples record the csv path of their knowledgebase, e.g. .../prompts/bank/Bank-knowledge.csv
+    return os.path.basename(knowledgebase_file_path).replace('-knowledge.csv', '')
+
+
+def read_pairs(path, knowledgebase=None):
+    pairs = defaultdict(list)
+    if path.endswith('.csv'):
+        if knowledgebase is None:
+            raise ValueError("--knowledgebase is required for csv input.")
+        faq, sentences_map = read_faq(path)
+        pairs[knowledgebase] = [(question, sentences_map[question]) for question in faq]
+        return pairs
+
+    with open(path, 'r') as infile:
+        for line in infile:
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            name = knowledgebase or get_knowledgebase_name(record.get('knowledgebase', ''))
+            if not name:
+                raise ValueError(f"No knowledgebase for the sample {record['question']!r}, use --knowledgebase.")
+            pairs[name].append((record['question'], record['answer']))
+    return pairs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('path', help='JSONL samples or csv file of approved pairs.')
+    parser.add_argument('--knowledgebase', help='Knowledgebase to add the pairs to (Bank, Delivery, ...).')
+    parser.add_argument('--batch-size', type=int, default=config.EMBEDDING_BATCH_SIZE)
+    args = parser.parse_args()
+
+    for knowledgebase, pairs in read_pairs(args.path, args.knowledgebase).items():
+        added = ingest_pairs(knowledgebase, pairs, batch_size=args.batch_size)
+        print(f"{knowledgebase}: {added} new rows ({len(pairs) - added} already known)")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,31 @@
-import os
+import logging
 from threading import Thread
 from queue import Queue, Empty
-from chat_tools.send_email import send_email
+from time import monotonic
+
+import config
+from chat_tools.send_email import EmailSender
+from prompts.prompts import prompt_registry
+from sample_store import SampleStore
+
+logger = logging.getLogger(__name__)
+
+
+def format_samples(records):
+    return "\n".join(f"'{record['question']}';'{record['answer']}';{record['knowledgebase']}" for record in records)
 
 
 class Learner(object):
-    def __init__(self):
+    def __init__(self, store=None, flush_size=config.LEARNER_FLUSH_SIZE,
+                 digest_interval=config.LEARNER_DIGEST_INTERVAL):
         self.samples = Queue()
-        self.samples_set = set()
+        self.store = store if store is not None else SampleStore()
 
         self.stop_flag = False
 
-        self.wait_with_update = 0
-        self.samples_filename = 'samples.txt'
+        self.flush_size = flush_size
+        self.digest_interval = digest_interval
+        self.last_digest = monotonic()
 
         self.admins_mail = ['nataf12386@gmail.com', 'odedwar@gmail.com']
 
@@ -22,46 +35,82 @@ class Learner(object):
     def add_sample(self, sample):
         self.samples.put(sample)
 
+    @property
+    def queue_depth(self):
+        return self.samples.qsize()
+
+    def stats(self):
+        return dict(self.store.stats(), queue_depth=self.queue_depth)
+
+    def get_batch(self, timeout=1):
+        # Blocks for the first sample only, then drains what is already queued, up to flush_size.
+        try:
+            batch = [self.samples.get(timeout=timeout)]
+        except Empty:
+            return []
+        while len(batch) < self.flush_size:
+            try:
+                batch.append(self.samples.get_nowait())
+            except Empty:
+                break
+        return batch
+
     def apply_active_learning(self):
-        print('runs active learning thread')
+        logger.info('Active learning thread started')
         while not self.stop_flag:
-            try:
-                question, answer, knowledgebase_file_path = self.samples.get(timeout=5)
-                self.samples_set.add((question, answer))
-                self.write_sample(question, answer, knowledgebase_file_path)
-                self.wait_with_update += 1
+            batch = self.get_batch()
+            if batch:
+                self.store.add_many(batch)
 
+            if monotonic() - self.last_digest >= self.digest_interval:
+                self.last_digest = monotonic()
                 self.update_admin()
-            except Empty:
-                continue
-        print('active learning done')
+
+        batch = self.get_batch(timeout=0)
+        while batch:  # Flush what was queued before the stop.
+            self.store.add_many(batch)
+            batch = self.get_batch(timeout=0)
+        logger.info('Active learning thread stopped')
 
     def stop_active_learning(self):
         self.stop_flag = True
         self.active_learning_thread.join()
 
-    def write_sample(self, question, answer, knowledgebase_file_path):
-        with open(self.samples_filename, 'a') as outfile:
-            outfile.write(f"'{question}'" + ';' + f"'{answer}'" + ';' + f"{knowledgebase_file_path}" + '\n')
-            outfile.write('\n')
-            print("New line wrote to the samples file")
-
     def update_admin(self):
-        if self.wait_with_update % 3 == 0:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            update_file_path = os.path.join(script_dir, 'prompts', 'update_mail.txt')
-            with open(update_file_path, 'r') as update_file:
-                update_mail = update_file.read().format(update=self.get_learning_updates_from_file())
+        # Sends one digest of the samples added since the last one, over a single SMTP connection.
+        offset = self.store.get_digest_offset()
+        new_samples = self.store.read(start=offset)
+        if not new_samples:
+            return False
+
+        update_mail = prompt_registry.update_mail.format(update=format_samples(new_samples))
+        try:
+            with EmailSender() as sender:
                 for mail in self.admins_mail:
-                    send_email(email_receiver=mail, display_name="DeceptifyBot",
-                               from_email="DeceptifyBot@donotreply.com",
-                               email_subject="Updates from learner",
-                               email_body=update_mail)
-                    print(f"mail send to {mail}")
+                    sender.send(email_receiver=mail, display_name="DeceptifyBot",
+                                from_email="DeceptifyBot@donotreply.com",
+                                email_subject="Updates from learner",
+                                email_body=update_mail)
+                    logger.info("Learner digest sent to %s", mail)
+        except Exception as e:  # The samples stay in the next digest.
+            logger.warning("Error while sending the learner digest: %s", e)
+            return False
+
+        self.store.set_digest_offset(offset + len(new_samples))
+        return True
+
+
+_learner = None
+
 
-    def get_learning_updates_from_file(self):
-        with open(self.samples_filename, 'r') as infile:
-            return infile.read()
+def get_learner():
+    # The learner thread starts with the first sample (or the warmup), not when the module is imported.
+    global _learner
+    if _learner is None:
+        _learner = Learner()
+    return _learner
 
 
-learner = Learner()
+def stop_learner():
+    if _learner is not None:
+        _learner.stop_active_learning()
@@ -1,29 +1,37 @@
-from langchain_community.llms import Ollama
-from time import time
-from chat_history import chatHistory
+from time import strftime, perf_counter
+from chat_history import chatHistory, format_messages
 from embeddings import embeddings
 from prompts.prompts import Prompts
-from learner import learner
-import re
+from learner import get_learner
+import config
+from model_router import model_router
+from semantic_cache import semantic_caches, is_cacheable
+from embedding_batcher import embedding_batcher
+from metrics import answer_latency, stage_latency
+from rules import GENERAL_RULES, rule_registry
+from prewarm import get_prompt_prefix
+import asyncio
+import logging
 
-# model_name = 'http://ollama:11434/'  # REPLACE IT TO llama3 IF YOU RUN LOCALLY
-model_name = 'llama3'  # REPLACE IT TO llama3 IF YOU RUN LOCALLY
+logger = logging.getLogger(__name__)
+
+# The Ollama model of each request class comes from the model tiers (config.MODEL_TIERS, MODEL_ROUTES).
+FALLBACK_ANSWER = "Can you repeat it?"
+GENERAL_FALLBACK_ANSWER = "Sorry, I can not talk right now. Please explore the options you have /help."
 
 # machine = 'ollama'  # REPLACE IT TO LOCALHOST IF YOU RUN LOCALLY
 machine = 'localhost'  # REPLACE IT TO LOCALHOST IF YOU RUN LOCALLY
 
 
 def add_sample_for_learning(prompt, answer, knowledgebase_file_path):
-    print("add_sample_for_learning called with prompt: {}".format(prompt))
-    learner.add_sample((prompt, answer, knowledgebase_file_path))
+    logger.debug("add_sample_for_learning called with prompt: %s", prompt)
+    get_learner().add_sample((prompt, answer, knowledgebase_file_path))
 
 
 class Llm(object):
     def __init__(self):
-        self.llm = Ollama(model=model_name)  # Switched the Ollama to ChatOllama
         self.embedding_model = embeddings()
         self.chat_history = chatHistory()
-        self.chat_history.initialize_role(Prompts.ROLE)
         self.user_prompt = self.chat_history.get_prompt()
         self.embedd_custom_knowledgebase = False
         self.mimic_name = 'Donald'  # Default value
@@ -32,9 +40,13 @@ class Llm(object):
         self.purpose = None
 
         self.general_role = Prompts.get_role()
-
-    def get_transcript(self):
-        return self.chat_history.get_transcription()
+        self.summary_prompt = Prompts.get_summary_prompt()
+        self.summary_task = None
+        self.semantic_cache = None
+        self.answer_source = None  # Which path produced the last answer: rule, faq, cache or llm.
+        self.rules = rule_registry.get(GENERAL_RULES)
+        self.rule_match = None  # Rule that answered the last message, if any.
+        self.timings = {}  # Seconds spent in each stage of the last answer.
 
     def flush(self):
         self.chat_history.flush()
@@ -43,98 +55,203 @@ class Llm(object):
     def initialize_new_attack(self, attack_purpose, profile_name):
         self.end_conv = False
         self.mimic_name = profile_name
-        Prompts.set_role(attack_purpose=attack_purpose)  # Defining the new role according to the purpose.
+        role = Prompts.get_attack_role(attack_purpose)  # Precompiled role template of the purpose.
         self.purpose = attack_purpose
         self.embedding_model.initialize_again(attack_purpose)  # Initialize the embedding with a purpose.
+        self.semantic_cache = semantic_caches.get(attack_purpose) if config.SEMANTIC_CACHE_ENABLED else None
+        self.rules = rule_registry.get(attack_purpose)
 
         self.chat_history.set_profile_name_for_transcript(profile_name)
-        self.chat_history.initialize_role(Prompts.ROLE)
+        self.chat_history.initialize_role(role)
         self.user_prompt = self.chat_history.get_prompt()
 
         self.embedd_custom_knowledgebase = False
         self.init_msg = f"Hello {self.mimic_name}, its Jason from {attack_purpose}."
         self.chat_history.add_ai_response(self.init_msg)
 
+    def get_state(self):
+        # Compact, json serializable state of the attack, enough to rehydrate an Llm later.
+        return {
+            'attack_type': self.purpose,
+            'profile_name': self.mimic_name,
+            'history': self.chat_history.get_state(),
+            'end_conv': self.end_conv,
+            'embedd_custom_knowledgebase': self.embedd_custom_knowledgebase,
+        }
+
+    def restore_state(self, state):
+        self.initialize_new_attack(state['attack_type'], state['profile_name'])
+        self.chat_history.set_state(state['history'])
+        self.end_conv = state.get('end_conv', False)
+        self.embedd_custom_knowledgebase = state.get('embedd_custom_knowledgebase', False)
+
     def get_init_msg(self):
         return self.init_msg
 
-    def generate_knowledgebase(self, gen_info):
-        return self.llm.invoke(Prompts.KNOWLEDGEBASE_ROLE.format(gen_info=gen_info))
+    async def agenerate_knowledgebase(self, gen_info):
+        prompt = Prompts.KNOWLEDGEBASE_ROLE.format(gen_info=gen_info)
+        answer, _, _ = await model_router.generate('knowledgebase', prompt)
+        return answer
 
     def get_chat_history(self):
         return [msg for msg in self.chat_history.get_chat_history() if msg not in ['user', 'assistant']]
 
-    def get_answer(self, prompt):
-        if not self.end_conv:  # Checks the conversation state
-            self.chat_history.add_human_message(prompt)
-            if not self.embedd_custom_knowledgebase:
-                self.embedding_model.generate_faq_embedding()
-                self.embedd_custom_knowledgebase = True
+    def prepare_answer(self, prompt, lookup=None):
+        # Records the user message and tries the cheap paths (rules, knowledgebase, validators, cache) before
+        # the LLM. `lookup` is the (vector, indices, distances) of the prompt when it was already searched in a
+        # batch. The terminal rules were already checked by match_rules, they never touch the embeddings.
+        self.chat_history.add_human_message(prompt)
+        if self.rule_match is not None:
+            self.answer_source = 'rule'
+            return self.rule_match.answer, False
 
-            answer, apply_active_learning = self.embedding_model.get_answer_from_embedding(prompt)
-            if answer is None:
-                chain = self.user_prompt | self.llm
-                time1 = time()
-                answer = None
-                validate = self.validate_number(prompt)
-                if validate:
-                    answer = validate
-                else:
-                    answer = chain.invoke({
-                        "history": self.chat_history.get_chat_history(),
-                        'name': self.mimic_name,  # Default value
-                        # 'place': 'park',  # Default value
-                        # 'target': 'address',  # Default value
-                        # 'connection': 'co-worker',  # Default value,
-                        # 'principles': prompts.get_principles(),
-                        "context": prompt
-                    })
-                print(time() - time1)
-
-            self.chat_history.add_ai_response(answer)
-            self.actions_for_next_state(apply_active_learning, prompt,
-                                        answer)  # Function that getting the llm for the next state
-
-            return answer
+        if not self.embedd_custom_knowledgebase:
+            self.embedding_model.generate_faq_embedding()
+            self.embedd_custom_knowledgebase = True
 
+        if lookup is not None:
+            answer, apply_active_learning = self.embedding_model.get_answer_from_neighbors(*lookup)
         else:
+            answer, apply_active_learning = self.embedding_model.get_answer_from_embedding(prompt)
+            self.timings.update(self.embedding_model.last_timings)
+        self.answer_source = 'faq'
+        if answer is None:
+            self.rule_match = self.rules.validate(prompt)
+            if self.rule_match is not None:
+                self.answer_source = 'rule'
+                return self.rule_match.answer, apply_active_learning
+        if answer is None and self.semantic_cache is not None and is_cacheable(prompt):
+            answer = self.semantic_cache.get(self.embedding_model.last_query_vector)
+            self.answer_source = 'cache'
+        if answer is None:
+            self.answer_source = 'llm'
+        return answer, apply_active_learning
+
+    def cache_answer(self, prompt, answer):
+        # Generated answers are kept for near-identical prompts of other sessions of the same attack type.
+        if self.semantic_cache is not None and is_cacheable(prompt, answer):
+            self.semantic_cache.put(self.embedding_model.last_query_vector, answer)
+
+    def get_context(self, prompt):
+        # The closest knowledgebase pairs ground the answer, the client message comes last.
+        pairs = self.embedding_model.last_context
+        if not pairs:
+            return prompt
+        knowledge = "\n".join(f"Q: {question} A: {answer}" for question, answer in pairs)
+        return f"Relevant answers:\n{knowledge}\nClient: {prompt}"
+
+    def get_prompt_inputs(self, prompt):
+        return {
+            "history": self.chat_history.get_prompt_history(),
+            'name': self.mimic_name,  # Default value
+            'time': strftime('%H:%M'),
+            # 'place': 'park',  # Default value
+            # 'target': 'address',  # Default value
+            # 'connection': 'co-worker',  # Default value,
+            # 'principles': prompts.get_principles(),
+            "context": self.get_context(prompt)
+        }
+
+    def match_rules(self, prompt):
+        self.rule_match = self.rules.match_terminal(prompt)
+        return self.rule_match
+
+    def get_stage_labels(self):
+        return {'attack_type': self.purpose, 'faq': 'hit' if self.answer_source == 'faq' else 'miss'}
+
+    def observe_stages(self):
+        labels = self.get_stage_labels()
+        for stage, seconds in self.timings.items():
+            stage_latency.observe(seconds, stage=stage, **labels)
+
+    def record_generation_stats(self, stats):
+        # Ollama reports its own durations (nanoseconds): model load, prompt prefill and token generation.
+        for stage, key in (('load', 'load_duration'), ('prefill', 'prompt_eval_duration'),
+                           ('generation', 'eval_duration')):
+            if stats.get(key):
+                self.timings[stage] = stats[key] / 1e9
+
+    def get_prompt_prefix(self):
+        # Same name as get_prompt_inputs, so Ollama can reuse the cached prefix on the first turn.
+        return get_prompt_prefix(self.user_prompt, name=self.mimic_name)
+
+    def complete_answer(self, prompt, answer, apply_active_learning):
+        self.chat_history.add_ai_response(answer)
+        self.actions_for_next_state(apply_active_learning, prompt,
+                                    answer)  # Function that getting the llm for the next state
+        return answer
+
+    def get_fallback_answer(self):
+        # The closest knowledgebase answer, sent when no model tier answers before its deadline.
+        pairs = self.embedding_model.last_context
+        return pairs[0][1] if pairs else FALLBACK_ANSWER
+
+    async def aget_answer(self, prompt, on_token=None, on_fallback=None):
+        """
+        Answers an attack turn. The embedding lookup is batched with the other users' lookups,
+        the generation streams from the model tier of attack turns and `on_token` is awaited with every chunk.
+        `on_fallback` is awaited when the tier misses its deadline and another tier or a canned answer is used.
+        """
+        if self.end_conv:
             return 'The conversation is done. Have a great day!'
 
+        start = perf_counter()
+        self.timings = {}
+        lookup = None
+        if self.match_rules(prompt) is None:
+            lookup = await embedding_batcher.search(self.embedding_model.kb, prompt.lower(), timings=self.timings)
+        answer, apply_active_learning = self.prepare_answer(prompt, lookup=lookup)
+        if answer is None:
+            history_start = perf_counter()
+            full_prompt = self.user_prompt.format(**self.get_prompt_inputs(prompt))
+            self.timings['history'] = perf_counter() - history_start
+            answer, stats, tier = await model_router.generate(
+                'attack', full_prompt, on_token=on_token, on_fallback=on_fallback,
+                fallback_answer=self.get_fallback_answer(), options={'num_predict': config.LLM_NUM_PREDICT})
+            self.record_generation_stats(stats)
+            if tier is None:
+                self.answer_source = 'fallback'
+            else:
+                self.cache_answer(prompt, answer)
+
+        answer_latency.observe(perf_counter() - start, path=self.answer_source, attack_type=self.purpose)
+        self.observe_stages()
+
+        answer = self.complete_answer(prompt, answer, apply_active_learning)
+        if self.chat_history.history.needs_summary() and (self.summary_task is None or self.summary_task.done()):
+            self.summary_task = asyncio.get_running_loop().create_task(self.summarize_history())
+        return answer
+
+    async def summarize_history(self):
+        # Folds the messages that left the prompt window into the rolling summary, after the reply was sent.
+        history = self.chat_history.history
+        pending = history.get_pending()
+        if not pending:
+            return
+        try:
+            summary, _, _ = await model_router.generate('summary', self.summary_prompt.format(
+                summary=history.summary or 'None', history=format_messages(pending)))
+            history.fold(summary, pending)
+        except Exception as e:
+            logger.warning("Error while summarizing the history: %s", e)
+
     def is_conversation_done(self):
         return self.end_conv
 
-    def validate_number(self, prompt):
-        # Regular expression to find the number
-        number = re.findall(r'\d+', prompt.replace(" ", ""))
-        # Convert the first match to an integer (or float if needed)
-        if number:
-            if self.purpose == "Bank":  # account number
-                if int(number[0]) == 0:
-                    return "This is not a real number"
-                elif len(number[0]) == 6:
-                    return "Thank you, we have solved the issue. Goodbye"
-
-                else:
-                    return "I need a 6 digit account number"
-            elif self.purpose == "Hospital":
-                if int(number[0]) == 0:
-                    return "This is not a real number"
-                elif len(number[0]) == 9:  # check for 0 at the start of the number
-                    return "Thank you, we have opened your account. Goodbye"
-                else:
-                    return "I need a 9 digit ID"
-        return None
-
     def actions_for_next_state(self, apply_active_learning, prompt, answer):
         if apply_active_learning:
             add_sample_for_learning(prompt, answer, self.embedding_model.knowledgebase_file_path)
 
-        if 'bye' in answer.lower() or 'bye' in prompt.lower():
+        # A terminal rule (e.g. the client says bye) or a terminal answer ends the conversation.
+        if (self.rule_match is not None and self.rule_match.terminal) or self.rules.is_terminal(answer):
             self.end_conv = True
             # self.flush() IN THE CHATBOT CASE, WE DONT NEED TO USE flush() AT ALL!
 
-    def get_general_answer(self, msg):
-        return self.llm.invoke(self.general_role.format(context=msg))
+    async def aget_general_answer(self, msg, on_token=None, on_fallback=None):
+        answer, _, _ = await model_router.generate('general', self.general_role.format(context=msg),
+                                                   on_token=on_token, on_fallback=on_fallback,
+                                                   fallback_answer=GENERAL_FALLBACK_ANSWER)
+        return answer
 
 
 class llm_factory(object):
@@ -144,5 +261,19 @@ class llm_factory(object):
         llm.initialize_new_attack(attack_type, profile_name)
         return llm
 
+    @staticmethod
+    def restore_attack(state):
+        llm = Llm()
+        llm.restore_state(state)
+        return llm
+
+
+_general_llm = None
+
 
-llm = Llm()
+def get_general_llm():
+    # The Llm of the general conversation, created on first use instead of at import time.
+    global _general_llm
+    if _general_llm is None:
+        _general_llm = Llm()
+    return _general_llm
@@ -0,0 +1,128 @@
+from threading import Lock
+
+from aiohttp import web
+
+import config
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram(object):
+    """
+    Cumulative bucket histogram of latencies (seconds), one series per combination of label values.
+    """
+
+    def __init__(self, name, description, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.description = description
+        self.buckets = tuple(buckets)
+        self.series = {}  # sorted label items -> [bucket counts, sum, count]
+        self._lock = Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self.series.get(key)
+            if series is None:
+                series = self.series[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    def quantile(self, q, **labels):
+        # Upper bound of the bucket holding the q-quantile, good enough for a report.
+        series = self.series.get(tuple(sorted(labels.items())))
+        if not series or not series[2]:
+            return 0.0
+        for bound, count in zip(self.buckets, series[0]):
+            if count >= q * series[2]:
+                return bound
+        return float('inf')
+
+    def summary(self):
+        report = {}
+        for key, (_, total, count) in list(self.series.items()):
+            labels = dict(key)
+            report[','.join(f'{k}={v}' for k, v in key) or 'all'] = {
+                'count': count,
+                'mean': total / count if count else 0.0,
+                'p50': self.quantile(0.5, **labels),
+                'p99': self.quantile(0.99, **labels),
+            }
+        return report
+
+
+class MetricsRegistry(object):
+    def __init__(self):
+        self.histograms = {}
+        self.gauges = {}
+        self._lock = Lock()
+
+    def histogram(self, name, description='', buckets=DEFAULT_BUCKETS):
+        with self._lock:
+            if name not in self.histograms:
+                self.histograms[name] = Histogram(name, description, buckets)
+            return self.histograms[name]
+
+    def gauge(self, name, description, callback, kind='gauge', label=None):
+        # A value read when scraped, e.g. a queue depth. `kind` is 'gauge' or 'counter'. With a `label`,
+        # the callback returns a dict of label value -> value, one series each.
+        with self._lock:
+            self.gauges[name] = (description, callback, kind, label)
+
+    def report(self):
+        return {name: histogram.summary() for name, histogram in list(self.histograms.items())}
+
+    def render(self):
+        # Prometheus text exposition format.
+        lines = []
+        for name, histogram in sorted(self.histograms.items()):
+            lines += [f"# HELP {name} {histogram.description}", f"# TYPE {name} histogram"]
+            for key, (counts, total, count) in sorted(list(histogram.series.items())):
+                for bound, bucket_count in zip(histogram.buckets, counts):
+                    lines.append(f"{name}_bucket{format_labels(key + (('le', bound),))} {bucket_count}")
+                lines.append(f"{name}_bucket{format_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{format_labels(key)} {total}")
+                lines.append(f"{name}_count{format_labels(key)} {count}")
+        for name, (description, callback, kind, label) in sorted(self.gauges.items()):
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+            if label is None:
+                lines.append(f"{name} {callback()}")
+            else:
+                for key, value in sorted(callback().items()):
+                    lines.append(f"{name}{format_labels(((label, key),))} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def format_labels(items):
+    if not items:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in items)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(items, escaped)) + '}'
+
+
+metrics = MetricsRegistry()
+answer_latency = metrics.histogram('answer_latency_seconds',
+                                   'Time to answer an attack turn, by the path that produced the answer.')
+admission_queue_time = metrics.histogram('admission_queue_seconds',
+                                         'Time a message waited for a generation slot before being handled.')
+stage_latency = metrics.histogram('stage_seconds',
+                                  'Time spent in each stage of an answer, by attack type and knowledgebase hit.')
+tier_latency = metrics.histogram('tier_latency_seconds',
+                                 'Generation time per model tier and request class, by outcome (ok, timeout, error).')
+
+
+async def handle_metrics(request):
+    return web.Response(text=metrics.render(), content_type='text/plain', charset='utf-8')
+
+
+async def start_metrics_server(host=config.METRICS_HOST, port=config.METRICS_PORT):
+    # Local /metrics endpoint, the returned runner is cleaned up on shutdown.
+    app = web.Application()
+    app.router.add_get('/metrics', handle_metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
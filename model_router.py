@@ -0,0 +1,126 @@
+import asyncio
+import logging
+from time import perf_counter
+
+import aiohttp
+
+import config
+from metrics import tier_latency
+from ollama_client import OllamaError, ollama_client
+
+logger = logging.getLogger(__name__)
+
+REQUEST_CLASSES = ('general', 'attack', 'summary', 'knowledgebase')
+
+
+class TierUnavailable(Exception):
+    pass
+
+
+class ModelTier(object):
+    def __init__(self, name, model, concurrency=config.TIER_DEFAULT_CONCURRENCY,
+                 deadline=config.TIER_DEFAULT_DEADLINE, fallback=None):
+        self.name = name
+        self.model = model
+        self.concurrency = concurrency
+        self.deadline = deadline
+        self.fallback = fallback
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.active = 0
+        self.requests = 0
+        self.timeouts = 0
+        self.errors = 0
+        self.answered = 0
+        self.total_time = 0.0  # Seconds of the answered generations.
+
+    def stats(self):
+        return {'model': self.model, 'active': self.active, 'requests': self.requests, 'timeouts': self.timeouts,
+                'errors': self.errors,
+                'mean_seconds': self.total_time / self.answered if self.answered else 0.0}
+
+
+class ModelRouter(object):
+    """
+    Sends every generation to the model tier of its request class. A tier runs at most `concurrency`
+    generations, an attempt that misses the tier deadline (slot wait included) or fails moves to the fallback
+    tier, and when no tier is left the caller's canned `fallback_answer` is returned instead.
+    """
+
+    def __init__(self, client=ollama_client, tiers=config.MODEL_TIERS, routes=config.MODEL_ROUTES,
+                 default_tier=config.DEFAULT_MODEL_TIER, concurrency=config.TIER_CONCURRENCY,
+                 deadlines=config.TIER_DEADLINES, fallbacks=config.TIER_FALLBACKS):
+        self.client = client
+        self.tiers = {
+            name: ModelTier(name, model, concurrency.get(name, config.TIER_DEFAULT_CONCURRENCY),
+                            deadlines.get(name, config.TIER_DEFAULT_DEADLINE), fallbacks.get(name))
+            for name, model in tiers.items()
+        }
+        if default_tier not in self.tiers:
+            raise ValueError(f"Unknown default model tier: {default_tier}")
+        for request_class, tier in routes.items():
+            if tier not in self.tiers:
+                raise ValueError(f"Unknown model tier {tier} for {request_class}")
+        for name, fallback in fallbacks.items():
+            if name not in self.tiers or fallback not in self.tiers:
+                raise ValueError(f"Unknown model tier in the fallback {name}={fallback}")
+        self.routes = dict(routes)
+        self.default_tier = default_tier
+        self.canned = 0
+
+    def get_tier(self, request_class):
+        return self.tiers[self.routes.get(request_class, self.default_tier)]
+
+    def get_models(self):
+        return sorted({tier.model for tier in self.tiers.values()})
+
+    async def run(self, tier, prompt, on_token, **kwargs):
+        async with tier.semaphore:
+            tier.active += 1
+            try:
+                return await self.client.generate(prompt, on_token=on_token, model=tier.model, **kwargs)
+            finally:
+                tier.active -= 1
+
+    async def generate(self, request_class, prompt, on_token=None, on_fallback=None, fallback_answer=None,
+                       **kwargs):
+        """
+        Returns (text, stats, tier name), the tier is None for the canned answer. `on_fallback` is awaited before
+        another tier is tried, so a streamed reply can drop the tokens of the abandoned attempt.
+        """
+        tier = self.get_tier(request_class)
+        tried = set()
+        while tier is not None and tier.name not in tried:
+            tried.add(tier.name)
+            tier.requests += 1
+            start = perf_counter()
+            try:
+                text, stats = await asyncio.wait_for(self.run(tier, prompt, on_token, **kwargs), tier.deadline)
+                elapsed = perf_counter() - start
+                tier.answered += 1
+                tier.total_time += elapsed
+                tier_latency.observe(elapsed, tier=tier.name, request_class=request_class, outcome='ok')
+                return text, stats, tier.name
+            except asyncio.TimeoutError:
+                tier.timeouts += 1
+                outcome = 'timeout'
+            except (OllamaError, aiohttp.ClientError) as e:
+                tier.errors += 1
+                outcome = 'error'
+                logger.warning("Model tier %s failed: %s", tier.name, e)
+            tier_latency.observe(perf_counter() - start, tier=tier.name, request_class=request_class,
+                                 outcome=outcome)
+
+            tier = self.tiers.get(tier.fallback) if tier.fallback else None
+            if on_fallback is not None:
+                await on_fallback()
+
+        if fallback_answer is None:
+            raise TierUnavailable(f"No model tier answered the {request_class} request in time")
+        self.canned += 1
+        return fallback_answer, {}, None
+
+    def stats(self):
+        return dict({name: tier.stats() for name, tier in self.tiers.items()}, canned=self.canned)
+
+
+model_router = ModelRouter()
@@ -1,32 +1,72 @@
 from dataclasses import dataclass
 
-from llm import llm_factory
+from transcript_store import transcript_writer
+from workers import model_pool
 
 
 @dataclass
 class Attack:
-    def __init__(self, attack_type, profile_name):
+    def __init__(self, attack_type, profile_name, state=None):
         self.attack_type = attack_type
         self.profile_name = profile_name
-        self.llm = llm_factory.generate_new_attack(attack_type, profile_name)
+        from llm import llm_factory  # Imported on the first attack, keeps the bot startup light.
+        if state is not None:
+            self.llm = llm_factory.restore_attack(state)
+        else:
+            self.llm = llm_factory.generate_new_attack(attack_type, profile_name)
 
 
 @dataclass
 class User:
     def __init__(self, user_id, user_name):
         self.current_answer = None
-        self.llm = None
+        self._llm = None
         self.attack = None
         self.attack_type = None
         self.user_id = user_id
         self.user_name = user_name
         self.is_in_attack = False
-        self.transcript = None
+        self.attack_state = None  # Saved state of an in-flight attack, the Llm is rehydrated from it lazily.
 
         self.tries_counter = 0  # This counter is for handling attack initialization problems in the chat itself.
         # It keeps track the tries of the user to generate new attack without any success
         # if some error occurs on the server side and session restart needed.
 
+    @property
+    def llm(self):
+        if self._llm is None and self.is_in_attack and self.attack_state is not None:
+            self.attack = Attack(attack_type=self.attack_type, profile_name=self.user_name, state=self.attack_state)
+            self._llm = self.attack.llm
+            self.attack_state = None
+        return self._llm
+
+    @llm.setter
+    def llm(self, llm):
+        self._llm = llm
+
+    def to_state(self):
+        # Only compact, json serializable state is stored, never the live Llm.
+        attack_state = self._llm.get_state() if self._llm is not None else self.attack_state
+        return {
+            'user_id': self.user_id,
+            'user_name': self.user_name,
+            'is_in_attack': self.is_in_attack,
+            'attack_type': self.attack_type,
+            'attack_state': attack_state if self.is_in_attack else None,
+            'current_answer': self.current_answer,
+            'tries_counter': self.tries_counter,
+        }
+
+    @staticmethod
+    def from_state(state):
+        user = User(user_id=state['user_id'], user_name=state['user_name'])
+        user.is_in_attack = state.get('is_in_attack', False)
+        user.attack_type = state.get('attack_type')
+        user.attack_state = state.get('attack_state')
+        user.current_answer = state.get('current_answer')
+        user.tries_counter = state.get('tries_counter', 0)
+        return user
+
     def is_restart_session(self):
         self.tries_counter += 1
 
@@ -38,21 +78,34 @@ class User:
         return False
 
     def start_new_attack(self, attack_type):
+        if self.is_in_attack:  # The unfinished attack keeps its own transcript.
+            transcript_writer.archive(self.user_id)
         self.is_in_attack = True
-        self.transcript = None
         self.attack_type = attack_type
+        self.attack_state = None
         self.attack = Attack(attack_type=attack_type, profile_name=self.user_name)
-        self.llm = llm_factory.generate_new_attack(attack_type, self.user_name)
+        self.llm = self.attack.llm  # The attack already owns its Llm, do not build a second one.
         self.current_answer = self.llm.get_init_msg()
+        transcript_writer.append(self.user_id, 'assistant', self.current_answer)
 
     def end_attack(self):
-        self.transcript = self.llm.get_transcript()
+        if self.is_in_attack:
+            transcript_writer.archive(self.user_id)
         self.is_in_attack = False
         self.attack = None
         self.llm = None
         self.attack_type = None
+        self.attack_state = None
 
-    def get_answer_from_llm(self, prompt):
-        answer = self.llm.get_answer(prompt)
-        self.current_answer = answer
+    async def aget_answer_from_llm(self, prompt, on_token=None, on_fallback=None):
+        llm = self._llm
+        if llm is None:  # Rehydrating a saved attack loads the knowledgebase, keep it off the event loop.
+            llm = await model_pool.run(self.user_id, lambda: self.llm)
+        answer = await llm.aget_answer(prompt, on_token=on_token, on_fallback=on_fallback)
+        self.record_turn(prompt, answer)
         return answer
+
+    def record_turn(self, prompt, answer):
+        self.current_answer = answer
+        transcript_writer.append(self.user_id, 'user', prompt)
+        transcript_writer.append(self.user_id, 'assistant', answer)
@@ -0,0 +1,89 @@
+import json
+from time import monotonic
+
+import aiohttp
+
+import config
+
+
+class OllamaError(Exception):
+    pass
+
+
+class AsyncOllamaClient(object):
+    """
+    Async client for the Ollama HTTP API (/api/generate) over one pooled aiohttp session.
+    Responses are streamed, `on_token` is awaited with every chunk of text as it arrives.
+    Every request asks Ollama to keep the model loaded for `keep_alive` unless it sets its own.
+    """
+
+    def __init__(self, base_url=config.OLLAMA_URL, model=config.OLLAMA_MODEL, pool_size=config.OLLAMA_POOL_SIZE,
+                 timeout=config.OLLAMA_TIMEOUT, keep_alive=config.OLLAMA_KEEP_ALIVE or None):
+        self.base_url = base_url.rstrip('/')
+        self.model = model
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.keep_alive = keep_alive
+        self.last_request = monotonic()
+        self._session = None
+
+    async def get_session(self):
+        # Created lazily, an aiohttp session must be bound to the running event loop.
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def stream(self, prompt, model=None, options=None, keep_alive=None, **extra):
+        """
+        Yields the raw json chunks of a generation. The last one has done=True and carries the stats
+        (eval_count, prompt_eval_duration, context, ...).
+        """
+        payload = {'model': model or self.model, 'prompt': prompt, 'stream': True}
+        if options:
+            payload['options'] = options
+        if keep_alive is None:
+            keep_alive = self.keep_alive
+        if keep_alive is not None:
+            payload['keep_alive'] = keep_alive
+        payload.update(extra)
+        self.last_request = monotonic()
+
+        session = await self.get_session()
+        async with session.post(f'{self.base_url}/api/generate', json=payload) as response:
+            if response.status != 200:
+                raise OllamaError(f"Ollama returned {response.status}: {await response.text()}")
+            async for line in response.content:
+                if not line.strip():
+                    continue
+                chunk = json.loads(line)
+                if 'error' in chunk:
+                    raise OllamaError(chunk['error'])
+                yield chunk
+                if chunk.get('done'):
+                    break
+
+    async def generate(self, prompt, on_token=None, **kwargs):
+        """
+        Returns the full completion text and the stats of the final chunk.
+        """
+        parts = []
+        stats = {}
+        async for chunk in self.stream(prompt, **kwargs):
+            token = chunk.get('response', '')
+            if token:
+                parts.append(token)
+                if on_token is not None:
+                    await on_token(token)
+            if chunk.get('done'):
+                stats = chunk
+        return ''.join(parts), stats
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+
+ollama_client = AsyncOllamaClient()
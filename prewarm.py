@@ -0,0 +1,89 @@
+import asyncio
+import logging
+from time import monotonic
+
+import aiohttp
+
+import config
+from model_router import model_router
+from ollama_client import OllamaError, ollama_client
+
+logger = logging.getLogger(__name__)
+
+PREFIX_MARK = '\0prefix\0'
+
+
+def get_prompt_prefix(template, **inputs):
+    # The part of a role prompt shared by every turn of an attack, up to the first per-turn input.
+    values = dict(inputs, time=PREFIX_MARK, history=PREFIX_MARK, context=PREFIX_MARK)
+    return template.format(**values).split(PREFIX_MARK, 1)[0]
+
+
+class Prewarmer(object):
+    """
+    Hides the Ollama cold costs from the first reply of an attack. prewarm() sends the role prompt prefix of a new
+    attack in the background, so the model is loaded and the prefix is in Ollama's prompt cache by the time the
+    client answers. The keepalive task loads the `models` again after `interval` seconds without any request.
+    """
+
+    def __init__(self, client=ollama_client, interval=config.OLLAMA_KEEPALIVE_INTERVAL, models=None):
+        self.client = client
+        self.interval = interval
+        self.models = models if models is not None else [client.model]
+        self.in_flight = {}  # key -> prewarm task
+        self.task = None
+        self.prewarms = 0
+        self.keepalives = 0
+        self.failures = 0
+
+    def prewarm(self, key, prefix, model=None):
+        task = self.in_flight.get(key)
+        if task is None or task.done():
+            task = self.in_flight[key] = asyncio.get_running_loop().create_task(self.send(prefix, model))
+            task.add_done_callback(lambda _: self.in_flight.pop(key, None))
+        return task
+
+    async def send(self, prompt, model=None):
+        # One generated token is enough, the prompt is processed (and cached) either way.
+        try:
+            await self.client.generate(prompt, model=model, options={'num_predict': 1})
+        except (OllamaError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+            self.failures += 1
+            logger.warning("Ollama prewarm failed: %s", e)
+            return False
+        if prompt:
+            self.prewarms += 1
+        else:
+            self.keepalives += 1
+        return True
+
+    async def load_models(self):
+        # An empty prompt only loads the model.
+        for model in self.models:
+            await self.send('', model)
+
+    async def keep_loaded(self):
+        await self.load_models()
+        while True:
+            idle = monotonic() - self.client.last_request
+            await asyncio.sleep(max(self.interval - idle, 1.0))
+            if monotonic() - self.client.last_request >= self.interval:
+                await self.load_models()
+
+    def start(self):
+        if self.task is None and self.interval > 0:
+            self.task = asyncio.get_running_loop().create_task(self.keep_loaded())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        for task in list(self.in_flight.values()):
+            task.cancel()
+
+    def stats(self):
+        return {'prewarms': self.prewarms, 'keepalives': self.keepalives, 'failures': self.failures,
+                'in_flight': len(self.in_flight)}
+
+
+prewarmer = Prewarmer(models=model_router.get_models())
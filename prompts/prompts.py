@@ -1,35 +1,65 @@
+import glob
+import logging
 import os
-from langchain.schema import AIMessage, HumanMessage, SystemMessage
-from langchain_core.prompts import SystemMessagePromptTemplate, PromptTemplate
+from types import MappingProxyType
+
+from langchain_core.prompts import PromptTemplate
+
+logger = logging.getLogger(__name__)
 
 
 def get_text_from_file(path):
     script_dir = os.path.dirname(os.path.abspath(__file__))
     path_to_file = os.path.join(script_dir, path)
-    print(path_to_file)
+    logger.debug("Reading prompt %s", path_to_file)
     with open(path_to_file, "r") as f:
         return f.read()
 
 
-class Prompts(object):
-    ROLE = None
+class PromptRegistry(object):
+    """
+    Every prompt template of the bot, read and compiled once at startup and read-only afterwards,
+    so concurrent attacks of different types never share mutable prompt state.
+    """
+
+    def __init__(self, prompts_dir=os.path.dirname(os.path.abspath(__file__))):
+        roles = {}
+        for path in sorted(glob.glob(os.path.join(prompts_dir, '*', '*Role.txt'))):
+            attack_purpose = os.path.basename(path)[:-len('Role.txt')]
+            roles[attack_purpose] = PromptTemplate.from_template(get_text_from_file(path))
+        self.roles = MappingProxyType(roles)
+
+        self.general_role = get_text_from_file(os.path.join(prompts_dir, 'role.txt'))
+        self.summary = get_text_from_file(os.path.join(prompts_dir, 'summary.txt'))
+        self.update_mail = get_text_from_file(os.path.join(prompts_dir, 'update_mail.txt'))
+        self.whatsapp_invitation = get_text_from_file(os.path.join(prompts_dir, 'zoom', 'whatsapp_invitation.txt'))
+
+    def get_role(self, attack_purpose):
+        try:
+            return self.roles[attack_purpose]
+        except KeyError:
+            raise ValueError(f"No role template for the attack type {attack_purpose}.")
 
+
+prompt_registry = PromptRegistry()
+
+
+class Prompts(object):
     # PRINCIPLES = get_text_from_file('Server/LLM/prompts/remember.txt')
     # KNOWLEDGEBASE_ROLE = SystemMessage(content=get_text_from_file('knowledge.txt'))
 
     @staticmethod
-    def set_role(attack_purpose):
-        Prompts.ROLE = PromptTemplate.from_template(
-            get_text_from_file(f'{attack_purpose.lower()}/{attack_purpose}Role.txt'))
+    def get_attack_role(attack_purpose):
+        return prompt_registry.get_role(attack_purpose)
 
     @staticmethod
     def get_principles(target='address'):
         return Prompts.PRINCIPLES.format(target=target)
 
+    @staticmethod
+    def get_summary_prompt():
+        return prompt_registry.summary
+
     @staticmethod
     def get_role():
-        try:
-            return get_text_from_file(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'role.txt'))
-        except Exception as e:
-            print(e)
-            return None
+        return prompt_registry.general_role
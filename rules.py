@@ -0,0 +1,124 @@
+import glob
+import json
+import os
+import re
+from collections import namedtuple
+from threading import Lock
+
+PROMPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prompts')
+GENERAL_RULES = 'general'
+
+RuleMatch = namedtuple('RuleMatch', ['name', 'answer', 'terminal'])
+
+
+class NumberValidator(object):
+    """
+    Answers a message holding a number (the first match of `pattern`): `zero` for 0, `valid` when it has
+    `length` digits, `invalid` otherwise.
+    """
+
+    def __init__(self, name, pattern, length, zero, valid, invalid, ignore_spaces=True, terminal_on_valid=False):
+        self.name = name
+        self.pattern = re.compile(pattern)
+        self.length = length
+        self.zero = zero
+        self.valid = valid
+        self.invalid = invalid
+        self.ignore_spaces = ignore_spaces
+        self.terminal_on_valid = terminal_on_valid
+
+    def match(self, text, compact):
+        found = self.pattern.search(compact if self.ignore_spaces else text)
+        if found is None:
+            return None
+        number = found.group(0)
+        if int(number) == 0:
+            return RuleMatch(self.name, self.zero, False)
+        if len(number) == self.length:
+            return RuleMatch(self.name, self.valid, self.terminal_on_valid)
+        return RuleMatch(self.name, self.invalid, False)
+
+
+class RuleSet(object):
+    """
+    Deterministic turns of one attack type. Terminal intents ("bye") are checked on every message before
+    the knowledgebase or the LLM are involved; validators only answer messages the knowledgebase missed,
+    before the LLM.
+    """
+
+    def __init__(self, name, terminal_patterns=(), terminal_answer=None, validators=()):
+        self.name = name
+        self.terminal = re.compile('|'.join(f'(?:{pattern})' for pattern in terminal_patterns)) \
+            if terminal_patterns else None
+        self.terminal_answer = terminal_answer
+        self.validators = list(validators)
+        self.evaluated = 0
+        self.hits = {}
+        self._lock = Lock()
+
+    @staticmethod
+    def from_file(name, path):
+        with open(path) as infile:
+            spec = json.load(infile)
+        terminal = spec.get('terminal', {})
+        return RuleSet(name, terminal.get('patterns', ()), terminal.get('answer'),
+                       [NumberValidator(**validator) for validator in spec.get('validators', [])])
+
+    def is_terminal(self, text):
+        return self.terminal is not None and self.terminal.search(text.lower()) is not None
+
+    def match_terminal(self, prompt):
+        # Counted as one evaluated message, validate() only adds its hits.
+        result = RuleMatch('terminal', self.terminal_answer, True) if self.is_terminal(prompt) else None
+        return self.record(result, evaluated=1)
+
+    def validate(self, prompt):
+        text = prompt.lower()
+        compact = text.replace(" ", "")
+        result = None
+        for validator in self.validators:
+            result = validator.match(text, compact)
+            if result is not None:
+                break
+        return self.record(result)
+
+    def record(self, result, evaluated=0):
+        with self._lock:
+            self.evaluated += evaluated
+            if result is not None:
+                self.hits[result.name] = self.hits.get(result.name, 0) + 1
+        return result
+
+    def stats(self):
+        hits = sum(self.hits.values())
+        return {'evaluated': self.evaluated, 'hits': dict(self.hits),
+                'hit_ratio': hits / self.evaluated if self.evaluated else 0.0}
+
+
+class RuleRegistry(object):
+    """
+    Rule sets read once from prompts/<type>/<Type>-rules.json, plus prompts/general-rules.json for
+    the general conversation. Attack types without a file get an empty rule set.
+    """
+
+    def __init__(self, prompts_dir=PROMPTS_DIR):
+        self.rule_sets = {}
+        for path in sorted(glob.glob(os.path.join(prompts_dir, '*', '*-rules.json'))):
+            name = os.path.basename(path)[:-len('-rules.json')]
+            self.rule_sets[name] = RuleSet.from_file(name, path)
+        general_path = os.path.join(prompts_dir, f'{GENERAL_RULES}-rules.json')
+        if os.path.exists(general_path):
+            self.rule_sets[GENERAL_RULES] = RuleSet.from_file(GENERAL_RULES, general_path)
+        self._lock = Lock()
+
+    def get(self, name):
+        with self._lock:
+            if name not in self.rule_sets:
+                self.rule_sets[name] = RuleSet(name)
+            return self.rule_sets[name]
+
+    def stats(self):
+        return {name: rule_set.stats() for name, rule_set in list(self.rule_sets.items())}
+
+
+rule_registry = RuleRegistry()
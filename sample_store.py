@@ -0,0 +1,84 @@
+import hashlib
+import json
+import os
+from threading import Lock
+from time import time
+
+import config
+
+
+class SampleStore(object):
+    """
+    Append-only, de-duplicated JSONL store of active learning samples. One json record per line,
+    a sample already in the store (same question, answer and knowledgebase) is not written again.
+    The number of records already sent to the admins is kept in `{path}.digest`.
+    """
+
+    def __init__(self, path=config.SAMPLES_PATH):
+        self.path = path
+        self.digest_path = f'{path}.digest'
+        self.keys = set()
+        self.count = 0
+        self.added = 0
+        self.duplicates = 0
+        self._lock = Lock()
+
+        for record in self.read():
+            self.keys.add(self.get_key(record))
+            self.count += 1
+
+    @staticmethod
+    def get_key(record):
+        raw = '\0'.join([record['question'].strip().lower(), record['answer'].strip(), record['knowledgebase']])
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def add_many(self, samples):
+        """
+        Appends the (question, answer, knowledgebase_file_path) samples that are not in the store yet,
+        in one write. Returns the new records.
+        """
+        records = []
+        with self._lock:
+            for question, answer, knowledgebase_file_path in samples:
+                record = {'question': question, 'answer': answer,
+                          'knowledgebase': knowledgebase_file_path or '', 'created_at': time()}
+                key = self.get_key(record)
+                if key in self.keys:
+                    self.duplicates += 1
+                    continue
+                self.keys.add(key)
+                records.append(record)
+
+            if records:
+                with open(self.path, 'a') as outfile:
+                    outfile.write(''.join(json.dumps(record) + '\n' for record in records))
+                self.count += len(records)
+                self.added += len(records)
+        return records
+
+    def read(self, start=0):
+        if not os.path.exists(self.path):
+            return []
+        with open(self.path, 'r') as infile:
+            return [json.loads(line) for i, line in enumerate(infile) if i >= start and line.strip()]
+
+    def get_digest_offset(self):
+        if not os.path.exists(self.digest_path):
+            return 0
+        with open(self.digest_path, 'r') as f:
+            return int(f.read().strip() or 0)
+
+    def set_digest_offset(self, offset):
+        tmp_path = f'{self.digest_path}.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(str(offset))
+        os.replace(tmp_path, self.digest_path)
+
+    def stats(self):
+        seen = self.added + self.duplicates
+        return {
+            'samples': self.count,
+            'added': self.added,
+            'duplicates': self.duplicates,
+            'dedup_hit_rate': self.duplicates / seen if seen else 0.0,
+        }
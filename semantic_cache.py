@@ -0,0 +1,101 @@
+import re
+from collections import OrderedDict
+from threading import Lock
+from time import monotonic
+
+import faiss
+import numpy as np
+
+import config
+from embeddings import EMBEDDING_DIM
+
+
+def is_cacheable(prompt, answer=None):
+    # Answers that depend on what the user typed (numbers) or that end the conversation are not reused.
+    if re.search(r'\d', prompt):
+        return False
+    return answer is None or 'bye' not in answer.lower()
+
+
+class SemanticCache(object):
+    """
+    Cache of LLM answers for one attack type, keyed by the embedding of the prompt that produced them.
+    A prompt hits when its nearest cached prompt is closer than `threshold` (L2) and not older than `ttl`.
+    Least recently used entries are evicted above `max_entries`.
+    """
+
+    def __init__(self, threshold=config.SEMANTIC_CACHE_THRESHOLD, ttl=config.SEMANTIC_CACHE_TTL,
+                 max_entries=config.SEMANTIC_CACHE_SIZE):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.index = faiss.IndexIDMap(faiss.IndexFlatL2(EMBEDDING_DIM))
+        self.entries = OrderedDict()  # id -> (answer, created_at)
+        self.next_id = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = Lock()
+
+    @staticmethod
+    def to_query(vector):
+        return np.asarray(vector, dtype="float32").reshape(1, -1)
+
+    def get(self, vector):
+        with self._lock:
+            if self.index.ntotal:
+                distances, ids = self.index.search(self.to_query(vector), 1)
+                entry_id = int(ids[0][0])
+                entry = self.entries.get(entry_id)
+                if entry is not None and distances[0][0] < self.threshold:
+                    answer, created_at = entry
+                    if monotonic() - created_at <= self.ttl:
+                        self.entries.move_to_end(entry_id)
+                        self.hits += 1
+                        return answer
+                    self.remove(entry_id)
+            self.misses += 1
+            return None
+
+    def put(self, vector, answer):
+        with self._lock:
+            entry_id = self.next_id
+            self.next_id += 1
+            self.index.add_with_ids(self.to_query(vector), np.array([entry_id], dtype="int64"))
+            self.entries[entry_id] = (answer, monotonic())
+            while len(self.entries) > self.max_entries:
+                self.remove(next(iter(self.entries)))
+
+    def remove(self, entry_id):
+        self.entries.pop(entry_id, None)
+        self.index.remove_ids(np.array([entry_id], dtype="int64"))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class SemanticCacheRegistry(object):
+    """
+    One SemanticCache per attack type, shared by all the sessions of that type.
+    """
+
+    def __init__(self):
+        self._caches = {}
+        self._lock = Lock()
+
+    def get(self, attack_type):
+        with self._lock:
+            if attack_type not in self._caches:
+                self._caches[attack_type] = SemanticCache()
+            return self._caches[attack_type]
+
+    def stats(self):
+        return {attack_type: cache.stats() for attack_type, cache in list(self._caches.items())}
+
+
+semantic_caches = SemanticCacheRegistry()
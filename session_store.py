@@ -0,0 +1,213 @@
+import asyncio
+import json
+import sqlite3
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
+from threading import Lock
+from time import monotonic, time
+
+import config
+from models import User
+
+
+class SQLiteSessionBackend(object):
+    """
+    Durable tier: one row of compact json state per user, in a local SQLite file.
+    """
+
+    def __init__(self, path=config.SESSION_DB_PATH):
+        self.path = path
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS sessions '
+                                '(user_id INTEGER PRIMARY KEY, state TEXT NOT NULL, updated_at REAL NOT NULL)')
+        self.connection.commit()
+        self._lock = Lock()
+
+    def load(self, user_id):
+        with self._lock:
+            row = self.connection.execute('SELECT state FROM sessions WHERE user_id = ?', (user_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def save(self, user_id, state):
+        with self._lock:
+            self.connection.execute('INSERT OR REPLACE INTO sessions (user_id, state, updated_at) VALUES (?, ?, ?)',
+                                    (user_id, json.dumps(state), time()))
+            self.connection.commit()
+
+    def delete(self, user_id):
+        with self._lock:
+            self.connection.execute('DELETE FROM sessions WHERE user_id = ?', (user_id,))
+            self.connection.commit()
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+
+class MemorySessionBackend(object):
+    """
+    Volatile tier used when no durable backend is configured, keeps the compact state only.
+    """
+
+    def __init__(self):
+        self.states = {}
+
+    def load(self, user_id):
+        return self.states.get(user_id)
+
+    def save(self, user_id, state):
+        self.states[user_id] = state
+
+    def delete(self, user_id):
+        self.states.pop(user_id, None)
+
+    def close(self):
+        pass
+
+
+class SessionStore(object):
+    """
+    Live User objects for the recently active users (LRU, evicted after `ttl` seconds of inactivity),
+    backed by a backend that stores the compact state of every user. An evicted user is rebuilt from its
+    state on the next message, its Llm is rehydrated lazily (see User.llm).
+    Users pinned by a handler in flight are never evicted. The async methods do the backend I/O on a thread,
+    the sync ones are for code that already runs off the event loop.
+    """
+
+    def __init__(self, backend, max_users=config.SESSION_CACHE_SIZE, ttl=config.SESSION_TTL):
+        self.backend = backend
+        self.max_users = max_users
+        self.ttl = ttl
+        self.users = OrderedDict()  # user_id -> [User, last_access]
+        self.pins = Counter()  # user_id -> handlers in flight
+        self.evicting = {}  # user_id -> User whose state is being written by an eviction
+        self._lock = Lock()
+
+    def touch(self, user_id):
+        # The live User, marked as just used, or None.
+        with self._lock:
+            entry = self.users.get(user_id)
+            if entry is None:
+                user = self.evicting.get(user_id)
+                if user is not None:  # Back before its eviction was written, take it back.
+                    self.users[user_id] = [user, monotonic()]
+                return user
+            entry[1] = monotonic()
+            self.users.move_to_end(user_id)
+            return entry[0]
+
+    def get(self, user_id):
+        user = self.touch(user_id)
+        if user is None:
+            state = self.backend.load(user_id)
+            if state is None:
+                return None
+            user = self.put(User.from_state(state))
+        self.evict()
+        return user
+
+    async def aget(self, user_id):
+        user = self.touch(user_id)
+        if user is None:
+            state = await asyncio.to_thread(self.backend.load, user_id)
+            if state is None:
+                return None
+            user = self.put(User.from_state(state))
+        await self.aevict()
+        return user
+
+    def put(self, user):
+        # Returns the live User of the id, which is `user` unless a concurrent call added one first.
+        with self._lock:
+            entry = self.users.setdefault(user.user_id, [user, monotonic()])
+            entry[1] = monotonic()
+            self.users.move_to_end(user.user_id)
+            return entry[0]
+
+    def add(self, user):
+        user = self.put(user)
+        self.evict()
+        return user
+
+    async def aadd(self, user):
+        user = self.put(user)
+        await self.aevict()
+        return user
+
+    def evict(self):
+        # Idle and least recently used users leave memory, their state is kept by the backend.
+        with self._lock:
+            evicted = self.pop_evicted()
+        self.save_evicted([(user, user.to_state()) for user in evicted])
+
+    async def aevict(self):
+        with self._lock:
+            evicted = self.pop_evicted()
+        if evicted:
+            await asyncio.to_thread(self.save_evicted, [(user, user.to_state()) for user in evicted])
+
+    def save_evicted(self, evicted):
+        for user, state in evicted:
+            self.backend.save(user.user_id, state)
+        with self._lock:
+            for user, _ in evicted:
+                if self.evicting.get(user.user_id) is user:
+                    del self.evicting[user.user_id]
+
+    def pop_evicted(self):
+        evicted = []
+        excess = len(self.users) - self.max_users
+        now = monotonic()
+        for user_id, (user, last_access) in self.users.items():
+            if excess <= 0 and now - last_access < self.ttl:
+                break
+            if self.pins[user_id]:
+                continue
+            evicted.append(user)
+            excess -= 1
+        for user in evicted:
+            del self.users[user.user_id]
+            self.evicting[user.user_id] = user
+        return evicted
+
+    @contextmanager
+    def pinned(self, user_id):
+        with self._lock:
+            self.pins[user_id] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.pins[user_id] -= 1
+                if not self.pins[user_id]:
+                    del self.pins[user_id]
+
+    def save(self, user):
+        self.backend.save(user.user_id, user.to_state())
+
+    async def asave(self, user):
+        # Serialize on the loop (the user is not mutated concurrently there), write on a thread.
+        state = user.to_state()
+        await asyncio.to_thread(self.backend.save, user.user_id, state)
+
+    def flush(self):
+        with self._lock:
+            users = [user for user, _ in self.users.values()]
+        for user in users:
+            self.save(user)
+
+    def __len__(self):
+        return len(self.users)
+
+    def close(self):
+        self.flush()
+        self.backend.close()
+
+
+def create_session_store(backend=config.SESSION_BACKEND):
+    if backend == 'sqlite':
+        return SessionStore(SQLiteSessionBackend())
+    if backend == 'memory':
+        return SessionStore(MemorySessionBackend())
+    raise ValueError(f"Unknown session backend: {backend}")
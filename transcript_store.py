@@ -0,0 +1,134 @@
+import asyncio
+import glob
+import gzip
+import json
+import logging
+import os
+import shutil
+from threading import Lock
+from time import time_ns
+
+import config
+
+logger = logging.getLogger(__name__)
+
+LIVE_FILE = 'live.jsonl'
+
+
+def format_record(record):
+    return f"{record['role']}: {record['text']}"
+
+
+class TranscriptWriter(object):
+    """
+    Append-only transcript log per user id (`{directory}/{user_id}/live.jsonl`, one json message per line).
+    Messages are buffered in memory and written by a background task, off the handler path. When the attack
+    ends the live log is compressed into `{directory}/{user_id}/{timestamp}.jsonl.gz`, and /transcript reads
+    the latest archive page by page.
+    """
+
+    def __init__(self, directory=config.TRANSCRIPT_DIR, interval=config.TRANSCRIPT_FLUSH_INTERVAL,
+                 page_chars=config.TRANSCRIPT_PAGE_CHARS):
+        self.directory = directory
+        self.interval = interval
+        self.page_chars = page_chars
+        self.pending = []  # (user_id, record), a None record archives the live log of the user.
+        self.task = None
+        self._lock = Lock()  # Attacks start and end on the model worker threads too.
+        self._write_lock = Lock()
+
+    def get_user_directory(self, user_id):
+        return os.path.join(self.directory, str(user_id))
+
+    def append(self, user_id, role, text):
+        with self._lock:
+            self.pending.append((user_id, {'role': role, 'text': text}))
+
+    def archive(self, user_id):
+        with self._lock:
+            self.pending.append((user_id, None))
+
+    def write_pending(self):
+        with self._lock:
+            pending, self.pending = self.pending, []
+        if not pending:
+            return
+        with self._write_lock:
+            lines = {}
+            for user_id, record in pending:
+                if record is not None:
+                    lines.setdefault(user_id, []).append(json.dumps(record) + '\n')
+                    continue
+                self.write_lines(user_id, lines.pop(user_id, []))
+                self.compress(user_id)
+            for user_id, user_lines in lines.items():
+                self.write_lines(user_id, user_lines)
+
+    def write_lines(self, user_id, lines):
+        if not lines:
+            return
+        os.makedirs(self.get_user_directory(user_id), exist_ok=True)
+        with open(os.path.join(self.get_user_directory(user_id), LIVE_FILE), 'a') as outfile:
+            outfile.write(''.join(lines))
+
+    def compress(self, user_id):
+        live_path = os.path.join(self.get_user_directory(user_id), LIVE_FILE)
+        if not os.path.exists(live_path):
+            return
+        archive_path = os.path.join(self.get_user_directory(user_id), f'{time_ns()}.jsonl.gz')
+        with open(live_path, 'rb') as infile, gzip.open(archive_path, 'wb') as outfile:
+            shutil.copyfileobj(infile, outfile)
+        os.remove(live_path)
+
+    async def flush(self):
+        await asyncio.to_thread(self.write_pending)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except OSError as e:
+                logger.warning("Error while writing the transcripts: %s", e)
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.get_running_loop().create_task(self.run())
+
+    async def close(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        await self.flush()
+
+    def get_latest_archive(self, user_id):
+        archives = sorted(glob.glob(os.path.join(self.get_user_directory(user_id), '*.jsonl.gz')))
+        return archives[-1] if archives else None
+
+    def read_page(self, user_id, page=1):
+        """
+        Returns the text of page `page` (from 1) of the last finished transcript and whether more pages follow,
+        or (None, False) if there is no such page. Only the archive up to the requested page is read.
+        A message longer than a page continues on the next pages.
+        """
+        path = self.get_latest_archive(user_id)
+        if path is None or page < 1:
+            return None, False
+        current, lines, size = 1, [], 0
+        with gzip.open(path, 'rt') as infile:
+            for line in infile:
+                text = format_record(json.loads(line))
+                for start in range(0, len(text), self.page_chars):
+                    chunk = text[start:start + self.page_chars]
+                    if lines and size + len(chunk) + 1 > self.page_chars:
+                        if current == page:
+                            return "\n".join(lines), True
+                        current, lines, size = current + 1, [], 0
+                    lines.append(chunk)
+                    size += len(chunk) + 1
+        if current == page and lines:
+            return "\n".join(lines), False
+        return None, False
+
+
+transcript_writer = TranscriptWriter()
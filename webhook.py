@@ -0,0 +1,139 @@
+"""
+Webhook serving over several bot worker processes. The front server receives the telegram updates and forwards
+each one to the worker that owns its user on a consistent hash ring, so a user's scene, session and history stay
+in one process while the users are spread over all the cores.
+"""
+import asyncio
+import hashlib
+import logging
+import multiprocessing
+from bisect import bisect
+
+from aiohttp import ClientError, ClientSession, ClientTimeout, web
+
+import config
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+class HashRing(object):
+    """
+    Consistent hashing of user ids onto the workers. Each worker owns `replicas` points of the ring, so
+    changing the number of workers only moves about 1/N of the users.
+    """
+
+    def __init__(self, nodes, replicas=100):
+        self.ring = sorted((self.hash(f"{node}#{replica}"), node) for node in nodes for replica in range(replicas))
+        self.points = [point for point, _ in self.ring]
+
+    @staticmethod
+    def hash(value):
+        return int.from_bytes(hashlib.md5(str(value).encode()).digest()[:8], 'big')
+
+    def get_node(self, key):
+        index = bisect(self.points, self.hash(key)) % len(self.points)
+        return self.ring[index][1]
+
+
+def get_update_user_id(update):
+    # The sender of the event carried by the update; updates without one are spread by update id.
+    for name, event in update.items():
+        if isinstance(event, dict):
+            sender = event.get('from') or event.get('user') or event.get('chat')
+            if sender and 'id' in sender:
+                return sender['id']
+    return update.get('update_id', 0)
+
+
+class UpdateRouter(object):
+    def __init__(self, worker_urls, secret=config.WEBHOOK_SECRET, timeout=10.0):
+        self.worker_urls = worker_urls
+        self.ring = HashRing(worker_urls)
+        self.secret = secret
+        self.timeout = timeout
+        self.session = None
+        self.forwarded = {url: 0 for url in worker_urls}
+        self.failed = 0
+
+    async def handle(self, request):
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            return web.Response(status=401)
+        update = await request.json()
+        worker_url = self.ring.get_node(get_update_user_id(update))
+        headers = {SECRET_HEADER: self.secret} if self.secret else None
+        try:
+            # Workers handle the update in the background and answer right away.
+            async with self.session.post(worker_url, json=update, headers=headers) as response:
+                self.forwarded[worker_url] += 1
+                return web.Response(status=response.status)
+        except (ClientError, asyncio.TimeoutError) as e:
+            # Not a 200, so telegram delivers the update again later.
+            self.failed += 1
+            logger.warning("Could not forward update to %s: %s", worker_url, e)
+            return web.Response(status=502)
+
+    async def stats(self, request):
+        return web.json_response({'forwarded': self.forwarded, 'failed': self.failed})
+
+    async def on_startup(self, app):
+        self.session = ClientSession(timeout=ClientTimeout(total=self.timeout))
+
+    async def on_cleanup(self, app):
+        await self.session.close()
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post(config.WEBHOOK_PATH, self.handle)
+        app.router.add_get('/workers', self.stats)
+        app.on_startup.append(self.on_startup)
+        app.on_cleanup.append(self.on_cleanup)
+        return app
+
+
+def get_worker_urls(workers=config.WEBHOOK_WORKERS, base_port=config.WORKER_BASE_PORT):
+    return [f"http://127.0.0.1:{base_port + index}{config.WEBHOOK_PATH}" for index in range(workers)]
+
+
+def start_workers(target, workers=config.WEBHOOK_WORKERS, base_port=config.WORKER_BASE_PORT):
+    # Spawned, not forked: every worker loads its own models and event loop.
+    context = multiprocessing.get_context('spawn')
+    processes = []
+    for index in range(workers):
+        process = context.Process(target=target, args=(base_port + index,), name=f"bot-worker-{index}")
+        process.start()
+        processes.append(process)
+    return processes
+
+
+async def register_webhook(token):
+    from aiogram import Bot
+
+    bot = Bot(token=token)
+    try:
+        await bot.set_webhook(config.WEBHOOK_URL.rstrip('/') + config.WEBHOOK_PATH,
+                              secret_token=config.WEBHOOK_SECRET or None)
+    finally:
+        await bot.session.close()
+
+
+def serve_webhook(worker_target, token, workers=config.WEBHOOK_WORKERS):
+    """
+    Starts `workers` processes running `worker_target(port)` and the front server that routes the updates to them.
+    """
+    processes = start_workers(worker_target, workers)
+    router = UpdateRouter(get_worker_urls(workers))
+    app = router.create_app()
+    if config.WEBHOOK_URL:
+        async def on_startup(app):
+            await register_webhook(token)
+
+        app.on_startup.append(on_startup)
+    try:
+        web.run_app(app, host=config.WEBHOOK_HOST, port=config.WEBHOOK_PORT)
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
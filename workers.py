@@ -0,0 +1,79 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from threading import Lock
+
+import config
+
+
+class ModelWorkerPool(object):
+    """
+    Runs blocking model work (Ollama, SentenceTransformer) on a bounded thread pool, so the aiogram
+    event loop keeps accepting updates while generations are in flight.
+    Calls submitted with the same key (the telegram user id) run one at a time, in submission order.
+    """
+
+    def __init__(self, max_workers=config.MODEL_WORKERS):
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='model-worker')
+        self._tails = {}  # key -> future resolved when the last call submitted for this key is done
+        self._lock = Lock()  # Guards the counters, which are updated from the loop and the worker threads.
+
+        self.queued = 0  # Calls waiting for their turn or for a free worker.
+        self.running = 0
+        self.completed = 0
+
+    @property
+    def queue_depth(self):
+        return self.queued
+
+    def stats(self):
+        return {
+            'max_workers': self.max_workers,
+            'queue_depth': self.queued,
+            'running': self.running,
+            'completed': self.completed,
+        }
+
+    async def run(self, key, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        previous = self._tails.get(key)
+        done = loop.create_future()
+        self._tails[key] = done
+
+        call = {'started': False}
+        with self._lock:
+            self.queued += 1
+        try:
+            if previous is not None:
+                await asyncio.shield(previous)  # Keep per-user ordering.
+            return await loop.run_in_executor(self.executor, self._call, call, partial(func, *args, **kwargs))
+        finally:
+            with self._lock:
+                if not call['started']:  # Cancelled before a worker picked it up.
+                    call['started'] = True
+                    self.queued -= 1
+                self.completed += 1
+            done.set_result(None)
+            if self._tails.get(key) is done:
+                del self._tails[key]
+
+    def _call(self, call, func):
+        # Runs on the worker thread.
+        with self._lock:
+            if call['started']:
+                return None
+            call['started'] = True
+            self.queued -= 1
+            self.running += 1
+        try:
+            return func()
+        finally:
+            with self._lock:
+                self.running -= 1
+
+    def shutdown(self, wait=True):
+        self.executor.shutdown(wait=wait)
+
+
+model_pool = ModelWorkerPool()